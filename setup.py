@@ -61,7 +61,8 @@ setup(
         'pytest>=2.5.2',
         'python-dateutil>=2.2',
         'python-gnupg>=0.3.6',
-        'requests>=2.3.0'
+        'requests>=2.3.0',
+        'futures>=2.1.6; python_version < "3"'
     ],
     classifiers=[
         'Development Status :: 5 - Production/Stable',
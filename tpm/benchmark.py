@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+microbenchmarks for TaskPaperManager
+
+usage: python -m tpm.benchmark [benchmark ...]
+
+without arguments all benchmarks are run; the results are printed to stdout
+"""
+
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import datetime
+import dateutil.parser
+import io
+import jinja2
+import markdown
+import os
+import random
+import re
+import shutil
+import smtplib
+import sys
+import tempfile
+import timeit
+
+from tpm import tpm
+from tpm.test.standins import StandInSMTPServer, StandInHTTPServer
+
+
+def sampleTaskLines(count, seed=1):
+    """creates reproducible task lines with a realistic mix of tags
+
+    :param count: the number of task lines
+    :param seed: seed for the random generator
+    :returns: list of task lines
+    """
+
+    rand = random.Random(seed)
+    lines = []
+    for i in range(count):
+        start = tpm.TODAY + datetime.timedelta(days=rand.randint(-30, 30))
+        parts = ['\t- task {0}'.format(i), '@prio({0})'.format(rand.choice(['high', 'medium', 'low'])),
+                 '@start({0})'.format(start)]
+        if rand.random() < 0.3:
+            due = tpm.TODAY + datetime.timedelta(days=rand.randint(-10, 10))
+            parts.append('@due({0})'.format(due))
+        if rand.random() < 0.2:
+            parts.append('@customer(customer{0})'.format(rand.randint(0, 99)))
+        if rand.random() < 0.1:
+            parts.append('@waiting(person{0})'.format(rand.randint(0, 9)))
+        if rand.random() < 0.05:
+            parts.append('@done({0})'.format(start))
+        if rand.random() < 0.05:
+            parts.append('@maybe')
+        lines.append('{0}\n'.format(' '.join(parts)))
+    return lines
+
+
+class benchSettings(object):
+    """the subset of the tpm settings used by the parser"""
+
+    debug = False
+    duedelta = 'days'
+    dueinterval = 3
+    cachedir = ''
+
+
+def report(name, count, seconds):
+    """prints a single benchmark result
+
+    :param name: the name of the measured code path
+    :param count: the number of processed items
+    :param seconds: the time needed for count items
+    """
+
+    print('{0:<45} {1:>14.1f} per second'.format(name, count / seconds))
+
+
+def measure(function, repeat=3):
+    """runs function repeat times and returns the fastest run in seconds"""
+
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def legacyTagScan(line):
+    """the tag extraction of parseInputTask before tokenizeTask; kept for comparison"""
+
+    result = {}
+    result['done'] = '@done' in line
+    result['maybe'] = '@maybe' in line
+    if '@repeat' in line:
+        result['repeat'] = re.search(r'\@repeat\((.*?)\)', line).group(1)
+    if '@due' in line:
+        result['due'] = re.search(r'\@due\((.*?)\)', line).group(1)
+    if '@prio' in line:
+        result['prio'] = re.search(r'\@prio\((.*?)\)', line).group(1)
+    if '@start' in line:
+        result['start'] = re.search(r'\@start\((.*?)\)', line).group(1)
+    for element in ('customer', 'waiting', 'agenda'):
+        if '@{0}'.format(element) in line:
+            result[element] = re.search(r'\@' + element + r'\((.*?)\)', line).group(1)
+    return result
+
+
+def tokenizerTagScan(line):
+    """the same tag extraction as legacyTagScan, based on tokenizeTask"""
+
+    tags = tpm.tokenizeTask(line)
+    result = {}
+    result['done'] = 'done' in tags
+    result['maybe'] = 'maybe' in tags
+    for element in ('repeat', 'due', 'prio', 'start', 'customer', 'waiting', 'agenda'):
+        if element in tags:
+            result[element] = tpm.tagValue(tags, element)
+    return result
+
+
+def legacyRemoveTaskParts(instring, removelist):
+    """removeTaskParts before compileRemoveList; kept for comparison"""
+
+    outstring = ''
+    cut_string = instring.split(' ')
+    cut_removelist = removelist.split(' ')
+    for i in range(0, len(cut_string)):
+        for j in range(0, len(cut_removelist)):
+            if cut_removelist[j] in cut_string[i]:
+                break
+        else:
+            outstring = '{0}{1} '.format(outstring, cut_string[i])
+    return outstring
+
+
+def benchRemoveTaskParts(count=50000):
+    """compares the nested loops of the old removeTaskParts with the compiled remove lists"""
+
+    lines = sampleTaskLines(count)
+    removelist = '@start @prio @project @customer @waiting'
+
+    def legacy():
+        for line in lines:
+            legacyRemoveTaskParts(line, removelist)
+
+    def compiled():
+        for line in lines:
+            tpm.removeTaskParts(line, removelist)
+
+    report('strip tags, nested loops (lines)', count, measure(legacy))
+    report('strip tags, compiled remove list (lines)', count, measure(compiled))
+
+
+def benchTokenizer(count=50000):
+    """compares the regex chain of the old parser with the single pass tokenizer"""
+
+    lines = sampleTaskLines(count)
+
+    def legacy():
+        for line in lines:
+            legacyTagScan(line)
+
+    def tokenizer():
+        for line in lines:
+            tokenizerTagScan(line)
+
+    report('tag scan, regex chain (lines)', count, measure(legacy))
+    report('tag scan, tokenizer (lines)', count, measure(tokenizer))
+
+
+def benchIngest(count=50000):
+    """compares a commit per inserted row with the batched insert of parseInput"""
+
+    sett = benchSettings()
+    rows = [tpm.parseInputTask(line, 'bench', sett)[0] for line in sampleTaskLines(count)]
+
+    def perrow():
+        con = tpm.initDB()
+        cur = con.cursor()
+        for row in rows:
+            cur.execute("insert into tasks ({0}) values ({1})".format(
+                ', '.join(tpm.TASKCOLUMNS), ', '.join('?' * len(tpm.TASKCOLUMNS))), row)
+            con.commit()
+
+    def batched():
+        con = tpm.initDB()
+        nextid = tpm.nextTaskId(con)
+        tpm.insertRecords(con, [(nextid + i,) + row for i, row in enumerate(rows)], [])
+        con.commit()
+
+    report('ingest, commit per row (tasks)', count, measure(perrow))
+    report('ingest, one transaction (tasks)', count, measure(batched))
+
+
+def benchDates(count=50000):
+    """compares dateutil with the memoized ISO fast path of parseDate"""
+
+    rand = random.Random(1)
+    dates = ['{0}'.format(tpm.TODAY + datetime.timedelta(days=rand.randint(-400, 400))) for i in range(count)]
+
+    def dateutilparser():
+        for mydate in dates:
+            datetime.datetime.date(dateutil.parser.parse(mydate))
+
+    def parsedate():
+        tpm._DATECACHE.clear()
+        for mydate in dates:
+            tpm.parseDate(mydate)
+
+    report('dates, dateutil (dates)', count, measure(dateutilparser))
+    report('dates, parseDate (dates)', count, measure(parsedate))
+
+
+def sampleDatabase(lines):
+    """loads task lines into a new database, like parseInput does
+
+    :param lines: list of task lines
+    :returns: the database connection
+    """
+
+    sett = benchSettings()
+    con = tpm.initDB()
+    tasks = []
+    tags = []
+    for taskid, line in enumerate(lines, tpm.nextTaskId(con)):
+        (row, tasktags) = tpm.parseInputTask(line, 'bench', sett)
+        tasks.append((taskid,) + row)
+        for name, values in tasktags.items():
+            for value in values:
+                tags.append((taskid, name, value))
+    tpm.insertRecords(con, tasks, [], tags)
+    con.commit()
+    return con
+
+
+def benchParseCache(count=40000):
+    """compares parseInput without cache, with a cold and with a warm parse cache"""
+
+    sett = benchSettings()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        tpfile = os.path.join(tmpdir, 'bench.taskpaper')
+        with io.open(tpfile, 'w', encoding='utf-8') as f:
+            f.write('bench:\n')
+            f.writelines(sampleTaskLines(count))
+
+        def parse(cache=None):
+            tpm.parseInput(tpfile, tpm.initDB(), sett, cache)
+
+        def cached():
+            cache = tpm.ParseCache(os.path.join(tmpdir, 'cache.sqlite'), sett)
+            parse(cache)
+            cache.close()
+
+        report('parseInput, no cache (lines)', count, measure(parse, repeat=1))
+        report('parseInput, cold cache (lines)', count, measure(cached, repeat=1))
+        report('parseInput, warm cache (lines)', count, measure(cached))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def benchParallelParse(count=200000):
+    """parseInput with 1, 2, 4 and 8 worker processes; checks that the output is identical"""
+
+    sett = benchSettings()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        tpfile = os.path.join(tmpdir, 'bench.taskpaper')
+        lines = sampleTaskLines(count)
+        with io.open(tpfile, 'w', encoding='utf-8') as f:
+            for i in range(0, count, 100):
+                f.write('project{0}:\n'.format(i))
+                f.writelines(lines[i:i + 100])
+
+        expected = None
+        for workers in (1, 2, 4, 8):
+            con = tpm.initDB()
+            seconds = measure(lambda: tpm.parseInput(tpfile, con, sett, workers=workers), repeat=1)
+            output = tpm.createOutFile(con)
+            if expected is None:
+                expected = output
+            assert output == expected
+            report('parseInput, {0} workers (lines)'.format(workers), count, seconds)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def legacyCreateTaskList(con, element, headline, mylist):
+    """createTaskList before the grouped query: one full scan per group; kept for comparison"""
+
+    mytasks = '\n\n## {0}\n'.format(headline)
+    for listelement in mylist:
+        mytasks = '{0}\n\n### {1}\n'.format(mytasks, listelement)
+        cursel = con.cursor()
+        cursel.execute("SELECT taskline, project FROM tasks where project != 'Repeat' and project != 'Error'\
+            ORDER BY prio asc, startdate desc ")
+        for row in cursel:
+            if '@{0}'.format(element) in row[0]:
+                if re.search(r'\@' + element + r'\((.*?)\)', row[0]).group(1) == listelement:
+                    taskstring = tpm.removeTaskParts(row[0], '@start @prio @project @customer @waiting')
+                    mytasks = '{0}\n{1}'.format(mytasks, taskstring)
+    return mytasks
+
+
+def benchReviewGroups(count=5000):
+    """compares one scan per group with the grouped query of createTaskList for a growing number of groups"""
+
+    for groups in (10, 100, 500):
+        rand = random.Random(groups)
+        lines = ['\t- task {0} @prio(medium) @start({1}) @customer(customer{2})\n'.format(
+            i, tpm.TODAY, rand.randint(0, groups - 1)) for i in range(count)]
+        con = sampleDatabase(lines)
+        mylist = tpm.createUniqueList(con, 'customer')
+        assert legacyCreateTaskList(con, 'customer', 'Customers', mylist) == \
+            tpm.createTaskList(con, 'customer', 'Customers', mylist)
+        report('review, scan per group ({0} groups)'.format(groups), 1,
+               measure(lambda: legacyCreateTaskList(con, 'customer', 'Customers', mylist), repeat=1))
+        report('review, grouped query ({0} groups)'.format(groups), 1,
+               measure(lambda: tpm.createTaskList(con, 'customer', 'Customers', mylist)))
+
+
+def legacyMarkdown2html(mytext):
+    """markdown2html before the shared Renderer: new template and markdown instance per call; kept for comparison"""
+
+    html = markdown.markdown(mytext, extensions=['extra'], output_format='html5')
+    return jinja2.Template(tpm.REVIEWTEMPLATE).render(content=html)
+
+
+def benchRender(count=500):
+    """compares a new template and markdown instance per call with the shared Renderer of markdown2html"""
+
+    texts = []
+    for i in range(10):
+        lines = sampleTaskLines(30, seed=i)
+        texts.append('# Review\n\n## Open tasks with prio high:\n{0}'.format(
+            ''.join(tpm.removeTaskParts(line.strip('\n'), '@start @prio') + '\n' for line in lines)))
+    for text in texts:
+        assert legacyMarkdown2html(text) == tpm.markdown2html(text)
+
+    def legacy():
+        for i in range(count):
+            legacyMarkdown2html(texts[i % len(texts)])
+
+    def renderer():
+        for i in range(count):
+            tpm.markdown2html(texts[i % len(texts)])
+
+    report('markdown2html, per call setup (renders)', count, measure(legacy))
+    report('markdown2html, shared renderer (renders)', count, measure(renderer))
+
+
+class notifySettings(object):
+    """the subset of the tpm settings used by sendMail and sendPushover"""
+
+    debug = False
+    smtpstarttls = False
+    smtpuser = 'user'
+    smtppassword = 'password'
+    encryptmail = False
+    pushovertoken = 'token'
+    pushoveruser = 'user'
+
+    def __init__(self, smtp, http):
+        self.smtpserver = '127.0.0.1'
+        self.smtpport = smtp.port
+        self.pushoverurl = http.url
+
+
+def benchNotify(count=20, delay=0.01):
+    """compares mail and pushover sent one after the other with sendNotifications, against slow local servers"""
+
+    smtpserver = StandInSMTPServer(delay=delay)
+    httpserver = StandInHTTPServer(delay=delay * 10)
+    try:
+        sett = notifySettings(smtpserver, httpserver)
+        notifications = [('mail', tpm.sendMail, ('<p>text</p>', 'subject', 'from@localhost', 'to@localhost',
+                          'html', False, sett), 5.0, 0),
+                         ('pushover', tpm.sendPushover, ('text', sett), 5.0, 0)]
+
+        def serial():
+            for i in range(count):
+                for notification in notifications:
+                    assert tpm.deliverNotification(notification).ok
+
+        def concurrent():
+            for i in range(count):
+                assert all(result.ok for result in tpm.sendNotifications(notifications))
+
+        report('notify, serial (runs)', count, measure(serial, repeat=1))
+        report('notify, concurrent (runs)', count, measure(concurrent, repeat=1))
+    finally:
+        smtpserver.stop()
+        httpserver.stop()
+
+
+def legacySendMail(message, sett):
+    """the smtp part of sendMail before MailTransport: a new connection and login per message; kept for comparison"""
+
+    conn = smtplib.SMTP(sett.smtpserver, sett.smtpport)
+    conn.login(sett.smtpuser, sett.smtppassword)
+    try:
+        conn.sendmail('from@localhost', ['to@localhost'], message)
+    finally:
+        conn.close()
+
+
+def benchSMTP(count=500):
+    """compares a new smtp connection per message with the shared MailTransport, against a local smtp sink"""
+
+    smtpserver = StandInSMTPServer()
+    httpserver = StandInHTTPServer()
+    try:
+        sett = notifySettings(smtpserver, httpserver)
+        message = 'Subject: bench\r\n\r\n{0}'.format('text ' * 200)
+
+        def legacy():
+            for i in range(count):
+                legacySendMail(message, sett)
+
+        def transport():
+            for i in range(count):
+                tpm.getMailTransport(sett, 5.0).send('from@localhost', ['to@localhost'], message)
+            tpm.closeMailTransports()
+
+        report('smtp, connection per message (messages)', count, measure(legacy, repeat=1))
+        report('smtp, shared connection (messages)', count, measure(transport, repeat=1))
+        assert len(smtpserver.messages) == 2 * count
+    finally:
+        smtpserver.stop()
+        httpserver.stop()
+
+
+BENCHMARKS = {
+    'dates': benchDates,
+    'ingest': benchIngest,
+    'notify': benchNotify,
+    'parallel': benchParallelParse,
+    'parsecache': benchParseCache,
+    'render': benchRender,
+    'review': benchReviewGroups,
+    'smtp': benchSMTP,
+    'strip': benchRemoveTaskParts,
+    'tokenizer': benchTokenizer,
+}
+
+
+def main(argv):
+    names = argv or sorted(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit('unknown benchmark {0}; available: {1}'.format(name, ', '.join(sorted(BENCHMARKS))))
+        print('## {0}'.format(name))
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""
+local stand-ins for the smtp server and the pushover api; used by the tests and by tpm.benchmark
+"""
+
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import threading
+import time
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+
+class StandInSMTPHandler(socketserver.StreamRequestHandler):
+    """the SMTP dialog of StandInSMTPServer"""
+
+    def reply(self, line):
+        self.wfile.write('{0}\r\n'.format(line).encode('ascii'))
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply('220 localhost stand-in')
+        mail = None
+        sent = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            if server.delay:
+                time.sleep(server.delay)
+            command = line.decode('ascii', 'replace').strip()
+            verb = command.split(' ')[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 AUTH PLAIN LOGIN')
+            elif verb in ('HELO', 'NOOP', 'RSET'):
+                self.reply('250 ok')
+            elif verb == 'AUTH':
+                self.reply('235 authenticated')
+            elif verb == 'MAIL':
+                if server.failures > 0:
+                    server.failures -= 1
+                    self.reply('451 try again later')
+                else:
+                    mail = {'from': command[10:], 'to': []}
+                    self.reply('250 ok')
+            elif verb == 'RCPT':
+                mail['to'].append(command[8:])
+                self.reply('250 ok')
+            elif verb == 'DATA':
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                data = []
+                for line in self.rfile:
+                    if line == b'.\r\n':
+                        break
+                    data.append(line)
+                mail['data'] = b''.join(data).decode('utf-8')
+                server.messages.append(mail)
+                if server.dropafterdata > 0:
+                    # the message is accepted, but the reply is lost
+                    server.dropafterdata -= 1
+                    break
+                self.reply('250 queued')
+                sent += 1
+                if sent == server.messagesperconnection:
+                    # like servers which limit the messages per connection; no reply to the next command
+                    break
+            elif verb == 'QUIT':
+                server.quits += 1
+                self.reply('221 bye')
+                break
+            else:
+                self.reply('502 not implemented')
+
+
+class StandInSMTPServer(socketserver.ThreadingTCPServer):
+    """a local SMTP server without TLS which accepts every login and message; for tests and benchmarks
+
+    :param delay: seconds to wait before every reply
+    :param failures: number of MAIL commands which are answered with a temporary error
+    :param messagesperconnection: the connection is closed after this number of messages; 0 for no limit
+    :param dropafterdata: number of messages after which the connection is closed instead of confirmed
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, delay=0, failures=0, messagesperconnection=0, dropafterdata=0):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), StandInSMTPHandler)
+        self.delay = delay
+        self.failures = failures
+        self.messagesperconnection = messagesperconnection
+        self.dropafterdata = dropafterdata
+        self.quits = 0
+        self.messages = []
+        self.connections = 0
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StandInHTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """answers every POST of a StandInHTTPServer with the configured status"""
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if server.delay:
+            time.sleep(server.delay)
+        server.requests.append((self.path, body))
+        self.send_response(server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(b'{"status": 1}')
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """a local HTTP server in place of the pushover api; for tests and benchmarks
+
+    :param delay: seconds to wait before every response
+    :param status: the HTTP status of the responses
+    """
+
+    daemon_threads = True
+
+    def __init__(self, delay=0, status=200):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHTTPHandler)
+        self.delay = delay
+        self.status = status
+        self.requests = []
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/1/messages.json'.format(self.server_address[1])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -1,9 +1,12 @@
+import os
+import sys
 import pytest
 from pytest import fixture
 import sqlite3
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 import tpm.tpm
+from tpm.test.standins import StandInSMTPServer, StandInHTTPServer
 
 
 @fixture
@@ -23,6 +26,12 @@ def test_initDB():
     #assert cursel.fetchone() == 1
     for row in cursel:
         assert row[0] == 1
+    cursel.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name='tags'")
+    for row in cursel:
+        assert row[0] == 1
+    cursel.execute("SELECT count(*) FROM sqlite_master WHERE type='index' AND name like 'tasks_%'")
+    for row in cursel:
+        assert row[0] == 2
 
 
 def test_removeTags1():
@@ -100,6 +109,88 @@ def test_removeTaskParts2():
     assert taskstring.strip() == 'testtask'
 
 
+def legacyRemoveTaskParts(instring, removelist):
+    # removeTaskParts before compileRemoveList; the reference for the golden tests
+    outstring = ''
+    cut_string = instring.split(' ')
+    cut_removelist = removelist.split(' ')
+    for i in range(0, len(cut_string)):
+        for j in range(0, len(cut_removelist)):
+            if cut_removelist[j] in cut_string[i]:
+                break
+        else:
+            outstring = '{0}{1} '.format(outstring, cut_string[i])
+    return outstring
+
+
+@pytest.mark.parametrize('removelist', ['@overdue @duesoon @today', '@maybe @start @due @prio @project',
+                                        '@repeat @project @start', '@start', '@start @prio',
+                                        '@start @prio @project @customer @waiting', '@', '', 'a  b', '(.*) [x]'])
+def test_removeTaskPartsGolden(removelist):
+    for instring in ['', ' ', '\t- testtask @start(2999-12-31) @prio(medium) @overdue',
+                     '\t- testtask  @start(2999-12-31)   @prio(high)@today @duesoon ',
+                     '- task @customer(ACME Corp) @waiting(bob) @project(work) @repeat(2w) @note',
+                     u'- t\u00e4sk @due(2014-01-01) @maybe (.*) [x] @startx xa b',
+                     '@start@prio@project', '-']:
+        assert tpm.tpm.removeTaskParts(instring, removelist) == legacyRemoveTaskParts(instring, removelist)
+
+
+def test_tokenizeTask1():
+    tags = tpm.tpm.tokenizeTask('- testtask @prio(high) @start(2999-12-31) @maybe @customer(a) @customer(b)')
+    assert tags == {'prio': ['high'], 'start': ['2999-12-31'], 'maybe': [None], 'customer': ['a', 'b']}
+
+
+def test_tokenizeTask2():
+    tags = tpm.tpm.tokenizeTask('- testtask @customer(ACME Corp) @SOC')
+    assert tpm.tpm.tagValue(tags, 'customer') == 'ACME Corp'
+    assert tpm.tpm.tagValue(tags, 'SOC') is None
+    assert tpm.tpm.tagValue(tags, 'due') is None
+    assert 'SOC' in tags
+
+
+def test_checkSanity():
+    assert tpm.tpm.checkSanity('- testtask @prio(high) @start(2999-12-31)') is True
+    assert tpm.tpm.checkSanity('- testtask @prio(high)') is False
+    assert tpm.tpm.checkSanity('- testtask @prio(high @start(2999-12-31)') is False
+
+
+def test_parseDate1():
+    assert tpm.tpm.parseDate('2014-05-15') == datetime(2014, 5, 15).date()
+    assert tpm.tpm.parseDate('15 May 2014') == datetime(2014, 5, 15).date()
+    assert '2014-05-15' in tpm.tpm._DATECACHE
+
+
+def test_parseDate2():
+    with pytest.raises(ValueError):
+        tpm.tpm.parseDate('2014-02-30')
+
+
+def test_classifyTasks(tmpdir):
+    TODAY = datetime.date(datetime.now())
+    mycon = loadedDB(tmpdir, u'work:\n'
+                             u'\t- task1 @prio(high) @start({0})\n'
+                             u'\t- task2 @prio(high) @start(2999-12-31) @due({1})\n'
+                             u'\t- task3 @prio(high) @start(2999-12-31) @due({2})\n'
+                             u'\t- task4 @prio(high) @start(2999-12-31) @due({3})\n'
+                             u'\t- broken\n'.format(TODAY, TODAY + timedelta(days=3), TODAY + timedelta(days=4),
+                                                     TODAY - timedelta(days=1)))
+    cursel = mycon.cursor()
+    cursel.execute("SELECT duesoon, overdue, today, startday, duedate, dueday FROM tasks ORDER BY taskid")
+    assert [tuple(row) for row in cursel] == [
+        (0, 0, 1, TODAY.toordinal(), None, None),
+        (1, 0, 0, datetime(2999, 12, 31).toordinal(), '{0}'.format(TODAY + timedelta(days=3)),
+         (TODAY + timedelta(days=3)).toordinal()),
+        (0, 0, 0, datetime(2999, 12, 31).toordinal(), '{0}'.format(TODAY + timedelta(days=4)),
+         (TODAY + timedelta(days=4)).toordinal()),
+        (0, 1, 0, datetime(2999, 12, 31).toordinal(), '{0}'.format(TODAY - timedelta(days=1)),
+         (TODAY - timedelta(days=1)).toordinal()),
+        (None, None, None, None, None, None)]
+    # the stage can be repeated
+    tpm.tpm.classifyTasks(mycon, tpm.tpm.loadSettings(str(tmpdir.join('tpm.cfg'))))
+    cursel.execute("SELECT sum(duesoon), sum(overdue), sum(today) FROM tasks")
+    assert tuple(cursel.fetchone()) == (1, 1, 1)
+
+
 # def test_sanitizer1():
 #     mycon = my_initDB()
 #     cursel = mycon.cursor()
@@ -259,6 +350,42 @@ def test_SetTags4():
         assert '@today' in row[0]
 
 
+def test_setNoteTag():
+    mycon = my_initDB()
+    cursel = mycon.cursor()
+    curin = mycon.cursor()
+    for taskline in ('- task1 @prio(high)', '- task2 @prio(high)', '- task3 @prio(high) @note'):
+        curin.execute("insert into tasks (prio, startdate, project, taskline, done,\
+            repeat, repeatinterval, duedate, duesoon, overdue, maybe, today) values\
+            (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ( 1, '2999-12-31', 'home', taskline, 0, 0,
+            '-', '2999-12-31', 0, 0, 0, 0))
+    curin.execute("insert into notes (taskid, noteline) values (1, 'note1')")
+    curin.execute("insert into notes (taskid, noteline) values (1, 'note2')")
+    curin.execute("insert into notes (taskid, noteline) values (3, 'note3')")
+    mycon.commit()
+    tpm.tpm.setNoteTag(mycon)
+    cursel.execute("SELECT taskline FROM tasks ORDER BY taskid")
+    assert [row[0] for row in cursel] == ['- task1 @prio(high) @note', '- task2 @prio(high)', '- task3 @prio(high) @note']
+
+
+def test_dailyTransform(tmpdir):
+    TODAY = datetime.date(datetime.now())
+    mycon = loadedDB(tmpdir, u'work:\n'
+                             u'\t- task1 @prio(high) @start({0}) @duesoon @due({1})\n'
+                             u'\t- task2 @prio(high) @start(2999-12-31) @done(2014-01-01)\n'
+                             u'\t- task3 @prio(low) @start(2999-12-31) @due(2999-12-31) @maybe\n'
+                             u'\t\tnote3\n'.format(TODAY, TODAY - timedelta(days=1)))
+    tpm.tpm.dailyTransform(mycon)
+    assert not mycon.in_transaction
+    cursel = mycon.cursor()
+    cursel.execute("SELECT project, taskline FROM tasks ORDER BY taskid")
+    assert [tuple(row) for row in cursel] == [
+        ('work', '\t- task1 @prio(high) @start({0}) @due({1})  @overdue @today'.format(TODAY, TODAY - timedelta(days=1))),
+        ('Archive', '\t- task2 @prio(high) @start(2999-12-31) @done(2014-01-01) @project(work)'),
+        ('Maybe', '\t- task3  @project(work) @note')]
+
+
 def test_parseArgs1():
     (myinfile, myconfigfile, mymode, backup) = tpm.tpm.parseArgs(['-i', 'myinfile', '-c', 'myconfigfile', '-m', 'review'])
     assert myinfile == 'myinfile'
@@ -376,10 +503,680 @@ def test_setrepeat():
 #     assert sett.reviewoutputmd is True
 
 
+CONFIG = """[tpm]
+debug: True
+duedelta: days
+dueinterval: 3
+
+[mail]
+sendmail: False
+
+[pushover]
+pushover: False
+
+[review]
+outputpdf: True
+outputhtml: True
+outputmd: True
+reviewpath: /tmp/review/
+reviewagenda: True
+reviewprojects: True
+reviewcustomers: True
+reviewwaiting: True
+reviewmaybe: True
+"""
+
+
+def writeConfig(tmpdir, text=CONFIG):
+    configfile = tmpdir.join('tpm.cfg')
+    configfile.write(text)
+    return str(configfile)
+
+
+def loadedDB(tmpdir, text):
+    """writes text to todo.txt in tmpdir and parses it into a new database with the settings of CONFIG"""
+    sett = tpm.tpm.loadSettings(writeConfig(tmpdir))
+    tpfile = tmpdir.join('todo.txt')
+    tpfile.write_text(text, encoding='utf-8')
+    mycon = tpm.tpm.initDB()
+    tpm.tpm.parseInput(str(tpfile), mycon, sett)
+    return mycon
+
+
+def test_setRepeatCatchUp(tmpdir):
+    TODAY = datetime.date(datetime.now())
+    mycon = loadedDB(tmpdir, u'Repeat:\n'
+                             u'\t- weekly @prio(high) @repeat(1w) @project(work) @start({0})\n'
+                             u'\t- daily @prio(low) @repeat(2d) @project(home) @start({1})\n'
+                             u'\t- unknown @prio(low) @repeat(2x) @project(home) @start({1})\n'.format(
+                                 TODAY - timedelta(days=15), TODAY - timedelta(days=5)))
+    tpm.tpm.setRepeat(mycon)
+    cursel = mycon.cursor()
+    cursel.execute("SELECT project, startdate, startday FROM tasks where repeat = 0 ORDER BY taskid")
+    # one instance for every missed occurrence, in chronological order
+    expected = [('work', 8), ('home', 3), ('work', 1), ('home', 1)]
+    assert [tuple(row) for row in cursel] == [
+        (project, '{0}'.format(TODAY - timedelta(days=days)), (TODAY - timedelta(days=days)).toordinal())
+        for (project, days) in expected]
+    cursel.execute("SELECT project, taskline FROM tasks where repeat = 1 ORDER BY taskid")
+    assert [tuple(row) for row in cursel] == [
+        ('Repeat', '\t- weekly @prio(high) @repeat(1w) @project(work)  @start({0})'.format(TODAY - timedelta(days=1))),
+        ('Repeat', '\t- daily @prio(low) @repeat(2d) @project(home)  @start({0})'.format(TODAY - timedelta(days=1))),
+        ('Error', '\t- unknown @prio(low) @repeat(2x) @project(home) @start({0})'.format(TODAY - timedelta(days=5)))]
+    cursel.execute("SELECT count(*) FROM tags where name = 'start'")
+    assert cursel.fetchone()[0] == 7
+
+
+def test_setRepeatCatchUpLimit(tmpdir, capsys):
+    TODAY = datetime.date(datetime.now())
+    mycon = loadedDB(tmpdir, u'Repeat:\n'
+                             u'\t- stale @prio(high) @repeat(1d) @project(work) @start(2001-01-01)\n'
+                             u'\t- weekly @prio(low) @repeat(1w) @project(home) @start({0})\n'.format(
+                                 TODAY - timedelta(days=8)))
+    tpm.tpm.setRepeat(mycon)
+    cursel = mycon.cursor()
+    # no instances for the stale repeat task; it is moved to Error unchanged
+    cursel.execute("SELECT project, taskline FROM tasks ORDER BY taskid")
+    assert [tuple(row) for row in cursel] == [
+        ('Error', '\t- stale @prio(high) @repeat(1d) @project(work) @start(2001-01-01)'),
+        ('Repeat', '\t- weekly @prio(low) @repeat(1w) @project(home)  @start({0})'.format(TODAY - timedelta(days=1))),
+        ('home', '\t- weekly @prio(low)  @start({0})'.format(TODAY - timedelta(days=1)))]
+    out, err = capsys.readouterr()
+    assert out == ('repeat task with more than 100 missed occurrences moved to Error; '
+                   'check @start: - stale @prio(high) @repeat(1d) @project(work) @start(2001-01-01)\n')
+
+
+def test_registerRecurrence(monkeypatch):
+    monkeypatch.setattr(tpm.tpm, 'RECURRENCERULES', list(tpm.tpm.RECURRENCERULES))
+    monkeypatch.setattr(tpm.tpm, '_RECURRENCECACHE', {})
+    assert tpm.tpm.compileRecurrence('eom') is None
+
+    def endOfMonth(match):
+        return lambda mydate: mydate + relativedelta(months=1, day=31) if mydate.day < 28 else \
+            mydate + relativedelta(days=1) + relativedelta(day=31)
+
+    tpm.tpm.registerRecurrence(r'eom', endOfMonth)
+    nextdate = tpm.tpm.compileRecurrence('eom')
+    assert nextdate(datetime(2015, 1, 31).date()) == datetime(2015, 2, 28).date()
+    assert nextdate(datetime(2015, 2, 28).date()) == datetime(2015, 3, 31).date()
+    assert tpm.tpm.compileRecurrence('eom') is nextdate
+    assert tpm.tpm.compileRecurrence('12w')(datetime(2015, 1, 1).date()) == datetime(2015, 3, 26).date()
+    assert tpm.tpm.compileRecurrence('0d') is None
+
+
+def test_loadSettings1(tmpdir):
+    configfile = writeConfig(tmpdir)
+    sett = tpm.tpm.loadSettings(configfile)
+    assert sett.debug is True
+    assert sett.duedelta == 'days'
+    assert sett.dueinterval == 3
+    assert sett.sendmail is False
+    assert sett.reviewpath == '/tmp/review/'
+    assert tpm.tpm.loadSettings(configfile) is sett
+
+
+def test_loadSettings2(tmpdir):
+    configfile = writeConfig(tmpdir)
+    sett = tpm.tpm.loadSettings(configfile)
+    writeConfig(tmpdir, CONFIG.replace('dueinterval: 3', 'dueinterval: 14'))
+    os.utime(configfile, (0, 0))
+    sett2 = tpm.tpm.loadSettings(configfile)
+    assert sett2 is not sett
+    assert sett2.dueinterval == 14
+
+
+def test_loadSettings3(tmpdir):
+    sett = tpm.tpm.loadSettings(writeConfig(tmpdir))
+    with pytest.raises(AttributeError):
+        sett.debug = False
+
+
+def test_loadSettings4(tmpdir):
+    configfile = writeConfig(tmpdir, CONFIG.replace('duedelta: days', 'duedelta: months'))
+    with pytest.raises(SystemExit):
+        tpm.tpm.loadSettings(configfile)
+
+
+def test_parseInput(tmpdir):
+    mycon = loadedDB(tmpdir, u'INBOX:\n'
+                             u'\tnote without task\n'
+                             u'\t- task1 @prio(high) @start(2999-12-31)\n'
+                             u'\t\tnote1\n'
+                             u'\t\tnote2\n'
+                             u'work:\n'
+                             u'\t- task2 @prio(low) @start(2999-12-31) @customer(\u00e4)\n'
+                             u'\t- broken task\n'
+                             u'\t\tnote3\n')
+    cursel = mycon.cursor()
+    cursel.execute("SELECT project, prio FROM tasks ORDER BY taskid")
+    assert [tuple(row) for row in cursel] == [('INBOX', 1), ('work', 3), ('Error', None)]
+    cursel.execute("SELECT tasks.project, noteline FROM notes JOIN tasks USING (taskid) ORDER BY noteid")
+    assert [tuple(row) for row in cursel] == [('INBOX', '\t\tnote1'), ('INBOX', '\t\tnote2'), ('Error', '\t\tnote3')]
+
+
+def test_readTaskPaper(tmpdir):
+    tpfile = tmpdir.join('todo.txt')
+    tpfile.write_binary(u'work:\n\t- task1 \u00fc\n\n-\n\t\tnote\rstill note\nhome:\n'.encode('utf-8'))
+    records = list(tpm.tpm.readTaskPaper(str(tpfile)))
+    assert records == [('project', u'work'), ('task', u'\t- task1 \u00fc\n'),
+                       ('note', u'\t\tnote\rstill note\n'), ('project', u'home')]
+
+
+def test_parseInputBatches(tmpdir, monkeypatch):
+    monkeypatch.setattr(tpm.tpm, 'INSERTBATCH', 2)
+    mycon = loadedDB(tmpdir, u'work:\n' + u''.join(
+        u'\t- task{0} @prio(high) @start(2999-12-31)\n\t\tnote{0}\n'.format(i) for i in range(5)))
+    cursel = mycon.cursor()
+    cursel.execute("SELECT taskline, noteline FROM notes JOIN tasks USING (taskid) ORDER BY noteid")
+    rows = [tuple(row) for row in cursel]
+    assert len(rows) == 5
+    for i, row in enumerate(rows):
+        assert row[0].startswith('\t- task{0} '.format(i))
+        assert row[1] == '\t\tnote{0}'.format(i)
+
+
+def test_createUniqueList(tmpdir):
+    mycon = loadedDB(tmpdir, u'work:\n'
+                             u'\t- task1 @prio(low) @start(2999-12-31) @customer(b)\n'
+                             u'\t- task2 @prio(high) @start(2999-12-31) @customer(a) @customer(c)\n'
+                             u'\t- task3 @prio(medium) @start(2999-12-31) @customer(b) @customer\n')
+    assert tpm.tpm.createUniqueList(mycon, 'customer') == ['a', 'b']
+    assert tpm.tpm.createUniqueList(mycon, 'waiting') == []
+    mytasks = tpm.tpm.createTaskList(mycon, 'customer', 'Customers', ['a', 'b', 'c'])
+    assert mytasks == '\n\n## Customers\n\n\n### a\n\n\t- task2 \n\n### b\n\n\t- task3 \n\t- task1 \n\n### c\n'
+
+
+def test_createOutFile(tmpdir):
+    mycon = loadedDB(tmpdir, u'INBOX:\n'
+                             u'\t- inbox @prio(low) @start(2999-12-31)\n'
+                             u'work:\n'
+                             u'\t- task1 @prio(low) @start(2999-12-31)\n'
+                             u'\t\tnote1\n'
+                             u'\t- task2 @prio(high) @start(2999-12-30)\n'
+                             u'\t- task3 @prio(high) @start(2999-12-31) @done(2014-01-01)\n'
+                             u'\t\tnote3\n'
+                             u'home:\n'
+                             u'\t- broken\n'
+                             u'\t- task4 @prio(medium) @start(2999-12-31) @maybe\n')
+    tpm.tpm.archiveDone(mycon)
+    tpm.tpm.archiveMaybe(mycon)
+    (mytxt, mytxtdone, mytxtmaybe) = tpm.tpm.createOutFile(mycon)
+    assert mytxt == ('\nwork:\n\t- task2 @prio(high) @start(2999-12-30)\n\t- task1 @prio(low) @start(2999-12-31)\n'
+                     '\t\tnote1\n\nRepeat:\nError:\n\t- broken\n\nINBOX:\n\t- inbox @prio(low) @start(2999-12-31)\n')
+    assert mytxtdone == '\t- task3 @prio(high) @start(2999-12-31) @done(2014-01-01) @project(work)\n\t\tnote3\n'
+    assert mytxtmaybe == '\t- task4  @project(home)\n'
+    assert tpm.tpm.printGroup(mycon, 'work') == '\t- task2 @prio(high) @start(2999-12-30)\n\t- task1 @prio(low) @start(2999-12-31)\n\t\tnote1\n'
+
+
+def test_myFile(tmpdir, monkeypatch):
+    monkeypatch.setattr(tpm.tpm, 'WRITEBUFFER', 4)
+    target = tmpdir.join('todo.txt')
+    tpm.tpm.myFile(u'work:\n\t- task \u00e4\n', str(target), 'w')
+    assert target.read_text('utf-8') == u'work:\n\t- task \u00e4\n'
+    # a new file gets the permissions of open()
+    reference = tmpdir.join('reference.txt')
+    reference.write('')
+    assert os.stat(str(target)).st_mode == os.stat(str(reference)).st_mode
+    reference.remove()
+    os.chmod(str(target), 0o640)
+    inode = os.stat(str(target)).st_ino
+    # unchanged content: the file is not replaced
+    assert tpm.tpm.replaceFile(u'work:\n\t- task \u00e4\n', str(target)) is False
+    assert os.stat(str(target)).st_ino == inode
+    assert tpm.tpm.replaceFile(u'work:\n', str(target)) is True
+    assert os.stat(str(target)).st_ino != inode
+    assert os.stat(str(target)).st_mode & 0o777 == 0o640
+    assert target.read_text('utf-8') == u'work:\n'
+
+    # a failed write leaves the old file and no temp file
+    def failingFsync(fd):
+        raise OSError('disk full')
+    monkeypatch.setattr(tpm.tpm.os, 'fsync', failingFsync)
+    with pytest.raises(SystemExit):
+        tpm.tpm.myFile(u'home:\n', str(target), 'w')
+    monkeypatch.undo()
+    assert target.read_text('utf-8') == u'work:\n'
+    assert tmpdir.listdir() == [target]
+
+    archive = tmpdir.join('todo_archive.txt')
+    tpm.tpm.myFile(u'', str(archive), 'a')
+    tpm.tpm.myFile(u'\t- done1\n', str(archive), 'a')
+    tpm.tpm.myFile(u'\t- done2\n', str(archive), 'a')
+    assert archive.read_text('utf-8') == u'\t- done1\n\t- done2\n'
+
+
+def test_appendArchive(tmpdir, monkeypatch, capsys):
+    archivedir = str(tmpdir.join('todo_archive'))
+    tpm.tpm.appendArchive(u'\t- task1 @done(2014-01-05) @customer(a) @project(work)\n\t\tnote1\n'
+                          u'\t- task2 @done(2014-02-01) @project(home)\n', archivedir)
+    tpm.tpm.appendArchive(u'\t- task3 @done(2014-01-20) @customer(b) @project(work)\n', archivedir)
+    tpm.tpm.appendArchive(u'\t- task4 @done(2014-03-01) @customer(a) @project(work)\n', archivedir, compress=True)
+    assert sorted(os.listdir(archivedir)) == ['2014-01.txt', '2014-02.txt', '2014-03.txt.gz', 'index.json']
+    index = tpm.tpm.loadArchiveIndex(archivedir)
+    assert (index['2014-01.txt']['first'], index['2014-01.txt']['last']) == ('2014-01-05', '2014-01-20')
+    assert index['2014-01.txt']['tags']['customer'] == ['a', 'b']
+
+    # segments without a match are not read
+    opened = []
+    realopen = tpm.tpm.io.open
+    monkeypatch.setattr(tpm.tpm.io, 'open', lambda name, *args, **kwargs: opened.append(name) or realopen(name, *args, **kwargs))
+    found = list(tpm.tpm.searchArchive(archivedir, project='work', tag=('customer', 'a')))
+    assert found == [u'\t- task1 @done(2014-01-05) @customer(a) @project(work)\n\t\tnote1\n',
+                     u'\t- task4 @done(2014-03-01) @customer(a) @project(work)\n']
+    assert [os.path.basename(name) for name in opened] == ['index.json', '2014-01.txt']
+    found = list(tpm.tpm.searchArchive(archivedir, since=datetime(2014, 1, 10).date(), until=datetime(2014, 2, 28).date()))
+    assert [task.split(' ')[1] for task in found] == ['task3', 'task2']
+    monkeypatch.undo()
+
+    assert tpm.tpm.archiveMain(['-e', '2014-01-31', '-t', 'customer', str(tmpdir.join('todo.txt'))]) == 0
+    out, err = capsys.readouterr()
+    assert out == (u'\t- task1 @done(2014-01-05) @customer(a) @project(work)\n\t\tnote1\n'
+                   u'\t- task3 @done(2014-01-20) @customer(b) @project(work)\n')
+
+
+def test_ParseCache(tmpdir, monkeypatch):
+    sett = tpm.tpm.loadSettings(writeConfig(tmpdir, CONFIG.replace('[mail]', 'cachedir: {0}\n\n[mail]'.format(tmpdir.join('cache')))))
+    TODAY = datetime.date(datetime.now())
+    tpfile = tmpdir.join('todo.txt')
+    tpfile.write_text(u'work:\n'
+                      u'\t- task1 @prio(high) @start(2999-12-31)\n'
+                      u'\t- task2 @prio(high) @start(2999-12-31) @due({0})\n'
+                      u'\t- broken\n'.format(TODAY + timedelta(days=4)), encoding='utf-8')
+
+    def parse():
+        mycon = my_initDB()
+        cache = tpm.tpm.openParseCache(str(tpfile), sett)
+        tpm.tpm.parseInput(str(tpfile), mycon, sett, cache)
+        cache.close()
+        cursel = mycon.cursor()
+        cursel.execute("SELECT taskline, duesoon FROM tasks ORDER BY taskid")
+        return (cache, [tuple(row) for row in cursel])
+
+    (cache, rows) = parse()
+    assert (cache.hits, cache.misses) == (0, 3)
+    assert rows[1][1] == 0
+    (cache, rows2) = parse()
+    assert (cache.hits, cache.misses) == (3, 0)
+    assert rows2 == rows
+    # two days later task2 is due soon
+    monkeypatch.setattr(tpm.tpm, 'TODAY', TODAY + timedelta(days=2))
+    (cache, rows3) = parse()
+    assert (cache.hits, cache.misses) == (3, 0)
+    assert rows3[1][1] == 1
+    # lines which vanished from the file are dropped from the cache
+    tpfile.write_text(u'work:\n\t- task1 @prio(high) @start(2999-12-31)\n', encoding='utf-8')
+    (cache, rows4) = parse()
+    assert len(rows4) == 1
+    assert list(tpm.tpm.openParseCache(str(tpfile), sett).entries) == list(cache.seen)
+
+
+def test_parseBatchArgs():
+    (filespecs, configfile, modus, backup, workers) = tpm.tpm.parseBatchArgs(
+        ['-c', 'myconfigfile', '-m', 'daily', '-j', '4', 'a.txt', 'team/*.txt=/tmp/out'])
+    assert filespecs == ['a.txt', 'team/*.txt=/tmp/out']
+    assert configfile == 'myconfigfile'
+    assert modus == 'daily'
+    assert backup is False
+    assert workers == 4
+
+
+def test_runBatch(tmpdir, capsys):
+    configfile = writeConfig(tmpdir, CONFIG.replace('outputpdf: True', 'outputpdf: False').replace(
+        'outputhtml: True', 'outputhtml: False').replace('reviewmaybe: True', 'reviewmaybe: False'))
+    for name in ('team1', 'team2'):
+        tmpdir.join('{0}.taskpaper'.format(name)).write_text(
+            u'work:\n\t- {0} task @prio(high) @start(2000-01-01)\n'.format(name), encoding='utf-8')
+    jobs = tpm.tpm.expandBatchFiles(['{0}/*.taskpaper={0}/out'.format(tmpdir), '{0}/missing.taskpaper'.format(tmpdir)])
+    assert [job[0] for job in jobs] == [str(tmpdir.join(name)) for name in ('team1.taskpaper', 'team2.taskpaper', 'missing.taskpaper')]
+    results = tpm.tpm.runBatch(jobs, configfile, 'review', workers=2)
+    assert [result[1] for result in results] == [0, 0, 1]
+    assert 'missing.taskpaper' in results[2][2]
+    for name in ('team1', 'team2'):
+        reviewfiles = tmpdir.join('out', name).listdir()
+        assert len(reviewfiles) == 1
+        assert '{0} task'.format(name) in reviewfiles[0].read_text('utf-8')
+    assert tpm.tpm.printBatchReport(results) == 1
+    out, err = capsys.readouterr()
+    assert out.endswith('3 files processed, 1 failed\n')
+
+
+def fakeHtml2pdf(html, outfile):
+    with open(outfile, 'wb') as f:
+        f.write(html.encode('utf-8'))
+
+
+def test_runFileReview(tmpdir, monkeypatch, capsys):
+    monkeypatch.setattr(tpm.tpm, 'html2pdf', fakeHtml2pdf)
+    sett = tpm.tpm.loadSettings(writeConfig(tmpdir))
+    tmpdir.join('todo.txt').write_text(u'work:\n\t- task1 @prio(high) @start(2000-01-01) @customer(a)\n', encoding='utf-8')
+    tmpdir.join('todo_maybe.txt').write_text(u'\t- someday  @project(work)\n', encoding='utf-8')
+    tpm.tpm.runFile(str(tmpdir.join('todo.txt')), sett, 'review', outputpath=str(tmpdir.mkdir('out')))
+    reviewfile = tmpdir.join('out', 'Review_{0}'.format(datetime.date(datetime.now())))
+    mytxt = tmpdir.join('out', reviewfile.basename + '.md').read_text('utf-8')
+    assert '### a\n\n\t- task1 ' in mytxt
+    assert mytxt.endswith('## Maybe list:\n\n\n\t- someday  \n')
+    html = tmpdir.join('out', reviewfile.basename + '.html').read_text('utf-8')
+    assert tmpdir.join('out', reviewfile.basename + '.pdf').read_text('utf-8') == html
+    out, err = capsys.readouterr()
+    assert 'pdf ' in out
+    assert 's saved\n' in out
+
+
+def test_createTaskListMaybe(tmpdir, monkeypatch):
+    maybefile = tmpdir.join('todo_maybe.txt')
+    cachedir = str(tmpdir.join('cache'))
+    maybefile.write_text(u'\t- task1 @prio(low) @project(work)\n\t- task2 @customer(a) \u00e4\n\t- task3', encoding='utf-8')
+    expected = tpm.tpm.createTaskListMaybe(str(maybefile))
+    assert expected == u'## Maybe list:\n\n\n\t- task1 \n\t- task2 \u00e4 \n\t- task3 \n'
+    assert tpm.tpm.createTaskListMaybe(str(maybefile), cachedir) == expected
+
+    processed = []
+    realRemoveTaskParts = tpm.tpm.removeTaskParts
+    monkeypatch.setattr(tpm.tpm, 'removeTaskParts', lambda line, removelist: processed.append(line) or
+                        realRemoveTaskParts(line, removelist))
+    # unchanged: the rendered list is reused
+    assert tpm.tpm.createTaskListMaybe(str(maybefile), cachedir) == expected
+    assert processed == []
+    # appended: only the incomplete line and the new lines are processed
+    with maybefile.open('ab') as f:
+        f.write(b' @waiting(x)\n\t- task4\n')
+    assert tpm.tpm.createTaskListMaybe(str(maybefile), cachedir) == tpm.tpm.createTaskListMaybe(str(maybefile))
+    assert processed[:2] == [u'\t- task3 @waiting(x)', u'\t- task4']
+    # rewritten: processed from the start
+    maybefile.write_text(u'\t- task5\n', encoding='utf-8')
+    assert tpm.tpm.createTaskListMaybe(str(maybefile), cachedir) == u'## Maybe list:\n\n\n\t- task5 \n'
+    maybefile.write_text(u'', encoding='utf-8')
+    assert tpm.tpm.createTaskListMaybe(str(maybefile), cachedir) == ''
+
+
+def test_markdown2html(tmpdir):
+    import jinja2
+    import markdown
+    # the second text uses the reference of the first one; it must not be resolved
+    for text in (u'# a\n\n[link][1] \u00e4\n\n[1]: http://example.com\n', u'# b\n\n[link][1]\n'):
+        assert tpm.tpm.markdown2html(text) == jinja2.Template(tpm.tpm.REVIEWTEMPLATE).render(
+            content=markdown.markdown(text, extensions=['extra'], output_format='html5'))
+    template = tmpdir.join('page.html')
+    template.write('<div>{{content}}</div>')
+    bytecodecache = tmpdir.mkdir('cache')
+    assert tpm.tpm.markdown2html('*a*', str(template), str(bytecodecache)) == '<div><p><em>a</em></p></div>'
+    assert len(bytecodecache.listdir()) == 1
+    # changes of the template file are picked up
+    template.write('<span>{{content}}</span>')
+    os.utime(str(template), (os.path.getmtime(str(template)) + 10,) * 2)
+    assert tpm.tpm.markdown2html('*a*', str(template), str(bytecodecache)) == '<span><p><em>a</em></p></span>'
+    assert tpm.tpm.templateVersion(str(template)) != tpm.tpm.templateVersion()
+
+
+def test_RenderCache(tmpdir, monkeypatch):
+    monkeypatch.setattr(tpm.tpm, 'html2pdf', fakeHtml2pdf)
+    sett = tpm.tpm.loadSettings(writeConfig(tmpdir, CONFIG.replace('reviewmaybe: True', 'reviewmaybe: True\nrendercachesize: 1')))
+    reviewfile = str(tmpdir.join('Review'))
+    timings = tpm.tpm.writeReviewOutputs('# Review\n\ntext1', reviewfile, sett)
+    assert 'markdown2html' in timings and 'cache' not in timings
+    html1 = tmpdir.join('Review.html').read_text('utf-8')
+    # same text: html and pdf are taken from the cache
+    timings = tpm.tpm.writeReviewOutputs('# Review\n\ntext1', reviewfile, sett)
+    assert 'cache' in timings and 'markdown2html' not in timings and 'pdf' not in timings
+    assert tmpdir.join('Review.html').read_text('utf-8') == html1
+    assert tmpdir.join('Review.md').read_text('utf-8') == '# Review\n\ntext1'
+    # a new text does not overwrite the cached files of the old text
+    timings = tpm.tpm.writeReviewOutputs('# Review\n\ntext2', reviewfile, sett)
+    assert 'markdown2html' in timings
+    assert 'text2' in tmpdir.join('Review.pdf').read_text('utf-8')
+    cache = tpm.tpm.openRenderCache(reviewfile, sett)
+    with open(cache.path(cache.key('# Review\n\ntext1'), 'html')) as f:
+        assert f.read() == html1
+    assert len(os.listdir(cache.cachedir)) == 6
+    # a cache hit does not change the review files
+    os.utime(str(tmpdir.join('Review.html')), (1, 1))
+    tpm.tpm.writeReviewOutputs('# Review\n\ntext2', reviewfile, sett)
+    assert os.path.getmtime(str(tmpdir.join('Review.html'))) == 1
+    # eviction removes the least recently used entries, html and pdf together
+    os.utime(cache.path(cache.key('# Review\n\ntext1'), 'used'), (1, 1))
+    cache.maxsize = sum(os.path.getsize(os.path.join(cache.cachedir, name)) for name in os.listdir(cache.cachedir)) - 1
+    cache.evict()
+    assert len(os.listdir(cache.cachedir)) == 3
+    assert not os.path.exists(cache.path(cache.key('# Review\n\ntext1'), 'pdf'))
+    assert not os.path.exists(cache.path(cache.key('# Review\n\ntext1'), 'html'))
+    assert os.path.exists(cache.path(cache.key('# Review\n\ntext2'), 'html'))
+
+
+def notifyConfig(smtpserver, httpserver, extra=''):
+    return CONFIG.replace('[mail]\nsendmail: False', """[mail]
+sendmail: True
+smtpserver: 127.0.0.1
+smtpport: {0}
+smtpstarttls: False
+smtpuser: user
+smtppassword: password
+sourceemail: from@localhost
+destemail: to@localhost
+encryptmail: False
+gnupghome: /tmp
+targetfingerprint: none""".format(smtpserver.port)).replace('[pushover]\npushover: False', """[pushover]
+pushover: True
+pushovertoken: token
+pushoveruser: user
+pushoverurl: {0}""".format(httpserver.url)) + extra
+
+
+def test_sendNotifications(tmpdir, monkeypatch, capsys):
+    monkeypatch.setattr(tpm.tpm, 'NOTIFYBACKOFF', 0)
+    smtpserver = StandInSMTPServer(failures=1)
+    httpserver = StandInHTTPServer()
+    try:
+        sett = tpm.tpm.loadSettings(writeConfig(tmpdir, notifyConfig(smtpserver, httpserver)))
+        tpfile = tmpdir.join('todo.txt')
+        tpfile.write_text(u'work:\n\t- task1 @prio(high) @start(2000-01-01) \u00e4\n', encoding='utf-8')
+        results = tpm.tpm.runFile(str(tpfile), sett, 'daily')
+        # the first MAIL command gets a temporary error
+        assert [(result.channel, result.ok, result.attempts, result.error) for result in results] == [
+            ('mail to@localhost', True, 2, None), ('pushover', True, 1, None)]
+        assert len(smtpserver.messages) == 1
+        assert smtpserver.messages[0]['to'] == ['<to@localhost>']
+        assert 'Subject: Taskpaper daily overview' in smtpserver.messages[0]['data']
+        assert httpserver.requests[0][0] == '/1/messages.json'
+        assert b'token=token' in httpserver.requests[0][1]
+    finally:
+        tpm.tpm.closeMailTransports()
+        smtpserver.stop()
+        httpserver.stop()
+    out, err = capsys.readouterr()
+    assert 'mail to@localhost sent in ' in out
+
+
+def test_MailTransport(tmpdir):
+    smtpserver = StandInSMTPServer(messagesperconnection=2)
+    httpserver = StandInHTTPServer()
+    try:
+        sett = tpm.tpm.loadSettings(writeConfig(tmpdir, notifyConfig(smtpserver, httpserver).replace(
+            'destemail: to@localhost', 'destemail: to@localhost, second@localhost\ndesthomeemail: home@localhost').replace(
+            'pushover: True', 'pushover: False')))
+        assert sett.destemails == ['to@localhost', 'second@localhost', 'home@localhost']
+        tpfile = tmpdir.join('todo.txt')
+        tpfile.write_text(u'work:\n\t- task1 @prio(high) @start(2000-01-01)\n', encoding='utf-8')
+        results = tpm.tpm.runFile(str(tpfile), sett, 'daily')
+        assert [(result.channel, result.ok) for result in results] == [
+            ('mail to@localhost', True), ('mail second@localhost', True), ('mail home@localhost', True)]
+        assert sorted(message['to'][0] for message in smtpserver.messages) == [
+            '<home@localhost>', '<second@localhost>', '<to@localhost>']
+        # one connection for the first two mails; the third one reconnects after the server closed it
+        assert smtpserver.connections == 2
+        transport = tpm.tpm.getMailTransport(sett, sett.mailtimeout)
+        assert transport.connects == 2
+        tpm.tpm.sendMail('text', 'subject', 'from@localhost', 'to@localhost', 'plain', False, sett, sett.mailtimeout)
+        assert smtpserver.connections == 2
+        tpm.tpm.closeMailTransports()
+        assert transport.conn is None
+    finally:
+        tpm.tpm.closeMailTransports()
+        smtpserver.stop()
+        httpserver.stop()
+
+
+def test_MailTransportNoResend(tmpdir, monkeypatch):
+    monkeypatch.setattr(tpm.tpm, 'NOTIFYBACKOFF', 0)
+    smtpserver = StandInSMTPServer(dropafterdata=1)
+    httpserver = StandInHTTPServer()
+    try:
+        sett = tpm.tpm.loadSettings(writeConfig(tmpdir, notifyConfig(smtpserver, httpserver)))
+        # the connection is lost after DATA: neither the transport nor the retries send the message again
+        results = tpm.tpm.sendNotifications([
+            ('mail', tpm.tpm.sendMail, ('text', 'subject', 'from@localhost', 'to@localhost', 'plain', False, sett),
+             sett.mailtimeout, sett.mailretries)])
+        assert [(result.ok, result.attempts) for result in results] == [(False, 1)]
+        assert 'may have been delivered' in results[0].error
+        assert len(smtpserver.messages) == 1
+        tpm.tpm.sendMail('text', 'subject', 'from@localhost', 'to@localhost', 'plain', False, sett)
+        assert len(smtpserver.messages) == 2
+    finally:
+        tpm.tpm.closeMailTransports()
+        smtpserver.stop()
+        httpserver.stop()
+
+
+class FakeGPG(object):
+    instances = []
+
+    class Crypt(object):
+        def __init__(self, data, ok):
+            self.data = data
+            self.ok = ok
+            self.status = 'encryption ok' if ok else 'invalid recipient'
+
+        def __str__(self):
+            return self.data
+
+    def __init__(self, gnupghome):
+        self.gnupghome = gnupghome
+        self.calls = []
+        FakeGPG.instances.append(self)
+
+    def encrypt(self, data, recipients, always_trust=False):
+        self.calls.append((data, recipients))
+        return FakeGPG.Crypt('-----BEGIN PGP MESSAGE-----\n{0}\n-----END PGP MESSAGE-----\n'.format(
+            len(data)), 'unknown' not in recipients)
+
+
+def test_encryptContent(tmpdir, monkeypatch):
+    monkeypatch.setattr(tpm.tpm.gnupg, 'GPG', FakeGPG)
+    monkeypatch.setattr(tpm.tpm, '_GPGHANDLES', {})
+    monkeypatch.setattr(FakeGPG, 'instances', [])
+    smtpserver = StandInSMTPServer()
+    httpserver = StandInHTTPServer()
+    try:
+        sett = tpm.tpm.loadSettings(writeConfig(tmpdir, notifyConfig(smtpserver, httpserver).replace(
+            'destemail: to@localhost', 'destemail: to@localhost, second@localhost').replace(
+            'encryptmail: False', 'encryptmail: True').replace(
+            'targetfingerprint: none', 'targetfingerprint: AAAA 1111, BBBB2222')))
+        assert sett.targetfingerprints == ['AAAA1111', 'BBBB2222']
+        tpfile = tmpdir.join('todo.txt')
+        tpfile.write_text(u'work:\n\t- task1 @prio(high) @start(2000-01-01)\n', encoding='utf-8')
+        results = tpm.tpm.runFile(str(tpfile), sett, 'daily')
+        assert [(result.channel, result.ok) for result in results] == [
+            ('mail to@localhost', True), ('mail second@localhost', True), ('pushover', True)]
+        # one keyring and one encryption for both receivers
+        assert len(FakeGPG.instances) == 1
+        assert [recipients for (data, recipients) in FakeGPG.instances[0].calls] == [['AAAA1111', 'BBBB2222']]
+        assert len(smtpserver.messages) == 2
+        for message in smtpserver.messages:
+            assert '-----BEGIN PGP MESSAGE-----' in message['data']
+            assert 'task1' not in message['data']
+
+        tpm.tpm.sendMail('text', 'subject', 'from@localhost', 'to@localhost', 'plain', True, sett)
+        assert len(FakeGPG.instances) == 1
+        assert len(FakeGPG.instances[0].calls) == 2
+        sett = tpm.tpm.loadSettings(writeConfig(tmpdir.mkdir('unknown'), notifyConfig(smtpserver, httpserver).replace(
+            'encryptmail: False', 'encryptmail: True').replace('targetfingerprint: none', 'targetfingerprint: unknown')))
+        with pytest.raises(tpm.tpm.NotificationError):
+            tpm.tpm.encryptContent('text', sett)
+    finally:
+        tpm.tpm.closeMailTransports()
+        smtpserver.stop()
+        httpserver.stop()
+
+
+def test_sendNotificationsFailures(tmpdir, monkeypatch):
+    monkeypatch.setattr(tpm.tpm, 'NOTIFYBACKOFF', 0)
+    smtpserver = StandInSMTPServer(delay=0.5)
+    httpserver = StandInHTTPServer(status=400)
+    try:
+        sett = tpm.tpm.loadSettings(writeConfig(tmpdir, notifyConfig(smtpserver, httpserver).replace(
+            'smtpstarttls: False', 'smtpstarttls: False\ntimeout: 0.1\nretries: 1')))
+        results = tpm.tpm.sendNotifications([
+            ('mail', tpm.tpm.sendMail, ('text', 'subject', 'from@localhost', 'to@localhost', 'plain', False, sett),
+             sett.mailtimeout, sett.mailretries),
+            ('pushover', tpm.tpm.sendPushover, ('text', sett), sett.pushovertimeout, sett.pushoverretries)])
+        # timeouts are retried, a rejected request is not
+        assert [(result.channel, result.ok, result.attempts) for result in results] == [
+            ('mail', False, 2), ('pushover', False, 1)]
+        assert 'timed out' in results[0].error
+        assert results[0].seconds < 0.5
+        assert results[1].error == 'NotificationError: pushover returned 400 Bad Request'
+    finally:
+        tpm.tpm.closeMailTransports()
+        smtpserver.stop()
+        httpserver.stop()
+
+
+def test_mainNotificationStatus(tmpdir, monkeypatch):
+    smtpserver = StandInSMTPServer()
+    httpserver = StandInHTTPServer(status=400)
+    try:
+        configfile = writeConfig(tmpdir, notifyConfig(smtpserver, httpserver))
+        tpfile = tmpdir.join('todo.txt')
+        tpfile.write_text(u'work:\n\t- task1 @prio(high) @start(2000-01-01)\n', encoding='utf-8')
+        monkeypatch.setattr(sys, 'argv', ['tpm.py', '-i', str(tpfile), '-c', configfile, '-m', 'daily'])
+        assert tpm.tpm.main() == 1
+        # in batch mode the file counts as failed
+        results = tpm.tpm.runBatch([(str(tpfile), None)], configfile, 'daily', workers=1)
+        assert results[0][1] == 1
+        assert results[0][2].startswith('sending pushover failed; NotificationError: pushover returned 400')
+        assert len(smtpserver.messages) == 2
+        # the batch worker says goodbye, too
+        assert smtpserver.quits == 2
+    finally:
+        tpm.tpm.closeMailTransports()
+        smtpserver.stop()
+        httpserver.stop()
+    monkeypatch.setattr(sys, 'argv', ['tpm.py', '-i', str(tpfile), '-c', writeConfig(tmpdir), '-m', 'daily'])
+    assert tpm.tpm.main() == 0
+
+
+def test_parseInputParallel(tmpdir, monkeypatch):
+    monkeypatch.setattr(tpm.tpm, 'PARSECHUNKLINES', 3)
+    sett = tpm.tpm.loadSettings(writeConfig(tmpdir))
+    tpfile = tmpdir.join('todo.txt')
+    lines = [u'note without task\n']
+    for project in range(10):
+        lines.append(u'project{0}:\n'.format(project))
+        lines.append(u'\tnote after project header\n')
+        for task in range(project):
+            lines.append(u'\t- task{0} @prio(high) @start(2999-12-31) @customer(c{1})\n'.format(task, project % 3))
+            lines.append(u'\t\tnote \u00e4{0}\n'.format(task))
+    tpfile.write_text(u''.join(lines), encoding='utf-8')
+    assert len(tpm.tpm.findChunks(str(tpfile), 3)) > 5
+
+    serial = my_initDB()
+    tpm.tpm.parseInput(str(tpfile), serial, sett)
+    parallel = my_initDB()
+    tpm.tpm.parseInput(str(tpfile), parallel, sett, workers=3)
+    assert tpm.tpm.createOutFile(parallel) == tpm.tpm.createOutFile(serial)
+    for table in ('tasks', 'notes', 'tags'):
+        assert list(map(tuple, parallel.execute("SELECT * FROM {0} ORDER BY rowid".format(table)))) == \
+            list(map(tuple, serial.execute("SELECT * FROM {0} ORDER BY rowid".format(table))))
+
+
 def test_usage(capsys):
     tpm.tpm.usage()
     out, err = capsys.readouterr()
-    assert out == 'tpm.py -i <inputfile> -c <configfile> -m <mode:daily|review>\noptional: -b to backup the todo-file before modifying it\n'
+    assert out == ('tpm.py -i <inputfile> -c <configfile> -m <mode:daily|review>\n'
+                   'optional: -b to backup the todo-file before modifying it\n'
+                   'several files: tpm.py --batch -c <configfile> -m <mode:daily|review> [-j <workers>] '
+                   '<file|glob>[=<outputpath>] ...\n'
+                   'archive search: tpm.py --archive [-s <yyyy-mm-dd>] [-e <yyyy-mm-dd>] [-p <project>] '
+                   '[-t <tag>[(<value>)]] <inputfile>\n')
 
 
 def test_printDebugOutput(capsys):
@@ -20,39 +20,96 @@ License: GPL v3 (for details see LICENSE file)
     2w = 2 weeks
     3d = 3 days
     1m = 1 month
-**duedate**: same format as startdate
+**duedate**: same format as startdate; NULL if the task has no due date
 **duesoon**: boolean; true if today is duedate minus DUEDELTA in DUEINTERVAL (constants) or less
 **overdue**: boolean; true if today is after duedate
 **maybe**: boolean; true if task should be moved to maybe list
+**today**: boolean; true if startdate is today
+**startday**, **dueday**: startdate and duedate as day numbers (proleptic Gregorian ordinal);
+    used for all date comparisons, the text columns are only used for display
+
+duesoon, overdue and today are set by classifyTasks from the day numbers
 """
 
 
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
+import collections
+import concurrent.futures
 import dateutil.relativedelta
 import email.mime.text
+import errno
+import filecmp
 import dateutil.parser
 import datetime
 import jinja2
 import markdown
 import logging
 import getopt
+import glob
+import gzip
+import hashlib
+import heapq
+import io
+import json
 import shutil
 import os
 import sys
+import time
 import re
-import urllib
 import smtplib
+import socket
 import gnupg
 import sqlite3
+import threading
 import weasyprint
 
 from six.moves import configparser
 from six.moves import http_client
+from six.moves.urllib.parse import urlencode, urlsplit
 
 TODAY = datetime.datetime.date(datetime.datetime.now())
 DAYBEFORE = TODAY - datetime.timedelta(days=1)
 
+# number of parsed tasks which are collected before they are written to the database
+INSERTBATCH = 1000
+
+# a task line starts with a dash, optionally indented by tabs
+TASKPATTERN = re.compile(r'\t*-')
+
+# dates in tags are normally ISO dates: yyyy-mm-dd
+ISODATEPATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})$')
+
+# maximum number of memoized results of parseDate
+DATECACHESIZE = 4096
+_DATECACHE = {}
+
+BRACKETPATTERN = re.compile(r'[()]')
+
+# seconds to wait before the first retry of a failed notification; doubled for every further retry
+NOTIFYBACKOFF = 1.0
+
+# part of the key of the review render cache; increase whenever markdown2html
+# or html2pdf produce a different result for the same markdown text
+RENDERVERSION = 1
+
+# parallel parsing: minimum number of lines per chunk
+PARSECHUNKLINES = 5000
+
+# output files are written in pieces of this many characters through a buffer of the same size
+WRITEBUFFER = 64 * 1024
+
+# segmented archive: the index of the segments in the archive directory
+ARCHIVEINDEX = 'index.json'
+
+# the columns of the tasks table, in the order returned by parseInputTask
+TASKCOLUMNS = ('prio', 'startdate', 'project', 'taskline', 'done', 'repeat',
+               'repeatinterval', 'duedate', 'duesoon', 'overdue', 'maybe', 'today',
+               'startday', 'dueday')
+
+# a tag is @name, optionally followed by a value in brackets: @name(value)
+TAGPATTERN = re.compile(r'@([\w-]+)(?:\(([^)]*)\))?', re.UNICODE)
+
 
 def initDB():
     """create a new sqlite in-memory db instance and create the table structure
@@ -76,14 +133,32 @@ def initDB():
             duesoon INTEGER,
             overdue INTEGER,
             maybe INTEGER,
-            today INTEGER
+            today INTEGER,
+            startday INTEGER,
+            dueday INTEGER
             )''')
+        # date comparisons are range predicates on the day numbers
+        cur.execute("CREATE INDEX tasks_project_done_prio_startday ON tasks(project, done, prio, startday)")
+        cur.execute("CREATE INDEX tasks_dueday ON tasks(dueday)")
         cur.execute('''CREATE TABLE notes(
             noteid INTEGER PRIMARY KEY,
             taskid INTEGER,
             noteline text,
             FOREIGN KEY(taskid) REFERENCES tasks(taskid)
             )''')
+        cur.execute("CREATE INDEX notes_taskid ON notes(taskid)")
+        # the tags of the tasks as parsed from the input file; one row per tag,
+        # value is NULL for tags without brackets
+        cur.execute('''CREATE TABLE tags(
+            taskid INTEGER,
+            name TEXT,
+            value TEXT,
+            FOREIGN KEY(taskid) REFERENCES tasks(taskid)
+            )''')
+        cur.execute("CREATE INDEX tags_name_value ON tags(name, value)")
+        cur.execute("CREATE INDEX tags_taskid ON tags(taskid)")
+        # for the set based updates of the daily stages
+        conn.create_function('removetaskparts', 2, removeTaskParts)
         conn.commit()
     except sqlite3.Error as e:
         sys.exit("initDB - An error occurred: {0}".format(e.args[0]))
@@ -95,6 +170,8 @@ def usage():
 
     print('tpm.py -i <inputfile> -c <configfile> -m <mode:daily|review>')
     print('optional: -b to backup the todo-file before modifying it')
+    print('several files: tpm.py --batch -c <configfile> -m <mode:daily|review> [-j <workers>] <file|glob>[=<outputpath>] ...')
+    print('archive search: tpm.py --archive [-s <yyyy-mm-dd>] [-e <yyyy-mm-dd>] [-p <project>] [-t <tag>[(<value>)]] <inputfile>')
 
 
 def parseArgs(argv):
@@ -135,77 +212,170 @@ def parseArgs(argv):
     return (inputfile, configfile, modus, backup)
 
 
+_REMOVECACHE = {}
+
+
+def compileRemoveList(removelist):
+    """compiles a remove list for removeTaskParts; the result is cached per remove list
+
+    :param removelist: the tags to be removed, separated by blanks
+    :returns: compiled pattern that matches any word containing one of the tags
+    """
+
+    pattern = _REMOVECACHE.get(removelist)
+    if pattern is None:
+        pattern = re.compile('|'.join(re.escape(part) for part in removelist.split(' ')), re.UNICODE)
+        _REMOVECACHE[removelist] = pattern
+    return pattern
+
+
 def removeTaskParts(instring, removelist):
     """"remove elements from a taskpaper string
 
+    every blank separated word which contains one of the elements of removelist is removed;
+    each remaining word is followed by a blank
+
     :param instring: a string to be parsed
     :param removelist: the tags to be removed from the string
     :returns: the new strings minus the removed tags
     """
 
-    outstring = ''
-    cut_string = instring.split(' ')    
-    cut_removelist = removelist.split(' ')
-    for i in range(0, len(cut_string)):
-        for j in range(0, len(cut_removelist)):
-            if cut_removelist[j] in cut_string[i]:
-                break
-        else:
-            outstring = '{0}{1} '.format(outstring, cut_string[i])
-    return outstring
+    search = compileRemoveList(removelist).search
+    kept = [word for word in instring.split(' ') if not search(word)]
+    if not kept:
+        return ''
+    return '{0} '.format(' '.join(kept))
 
 
-class settings:
-    """ contains the settings for TPM, parsed from the config file """
+class settings(object):
+    """ contains the settings for TPM, parsed and validated from the config file
+
+    instances are read-only; use loadSettings() to get a cached instance
+    """
 
     def __init__(self, configfile):
         Config = configparser.ConfigParser()
-        Config.read(configfile)
-        self.debug = Config.getboolean('tpm', 'debug')
-        self.duedelta = ConfigSectionMap(Config, 'tpm')['duedelta']
-        self.dueinterval = Config.getint('tpm', 'dueinterval')
-        self.sendmail = Config.getboolean('mail', 'sendmail')
-        if self.sendmail:
-            self.smtpserver = ConfigSectionMap(Config, 'mail')['smtpserver']
-            self.smtpport = Config.getint('mail', 'smtpport')
-            self.smtpuser = ConfigSectionMap(Config, 'mail')['smtpuser']
-            self.smtppassword = ConfigSectionMap(Config, 'mail')['smtppassword']
-            self.encryptmail = Config.getboolean('mail', 'encryptmail')
-            self.gnupghome = ConfigSectionMap(Config, 'mail')['gnupghome']
-            self.targetfingerprint = ConfigSectionMap(Config, 'mail')['targetfingerprint']
-            self.sourceemail = ConfigSectionMap(Config, 'mail')['sourceemail']
-
-            self.destemail = ConfigSectionMap(Config, 'mail')['destemail']
-        else:
+        if not Config.read(configfile):
+            sys.exit("settings - config file {0} not found".format(configfile))
+        try:
+            tpmsection = ConfigSectionMap(Config, 'tpm')
+            self.debug = Config.getboolean('tpm', 'debug')
+            self.duedelta = tpmsection['duedelta']
+            self.dueinterval = Config.getint('tpm', 'dueinterval')
+            self.sendmail = Config.getboolean('mail', 'sendmail')
+            if self.sendmail:
+                mailsection = ConfigSectionMap(Config, 'mail')
+                self.smtpserver = mailsection['smtpserver']
+                self.smtpport = Config.getint('mail', 'smtpport')
+                self.smtpuser = mailsection['smtpuser']
+                self.smtppassword = mailsection['smtppassword']
+                self.encryptmail = Config.getboolean('mail', 'encryptmail')
+                self.gnupghome = mailsection['gnupghome']
+                self.targetfingerprint = mailsection['targetfingerprint']
+                # the mail is encrypted for all listed keys; blanks inside a fingerprint are ignored
+                self.targetfingerprints = [fingerprint.replace(' ', '') for fingerprint in
+                                           self.targetfingerprint.split(',') if fingerprint.strip()]
+                if self.encryptmail and not self.targetfingerprints:
+                    raise KeyError('targetfingerprint')
+                self.sourceemail = mailsection['sourceemail']
+
+                # receivers: a list in destemail and/or the separate work and home addresses
+                self.destemail = mailsection.get('destemail') or ''
+                self.destemails = [address.strip() for address in self.destemail.split(',') if address.strip()]
+                for option in ('destworkemail', 'desthomeemail'):
+                    if mailsection.get(option):
+                        self.destemails.append(mailsection[option].strip())
+                if not self.destemails:
+                    raise KeyError('destemail')
+            else:
 
-            self.smtpserver = ''
-            self.smtpport = 1
-            self.smtpuser = ''
-            self.smtppassword = ''
-            self.encryptmail = False
-            self.gnupghome = ''
-            self.targetfingerprint = ''
-            self.sourceemail = ''
-
-            self.destemail = ''
-        self.pushover = Config.getboolean('pushover', 'pushover')
-        if self.pushover:
-            self.pushovertoken = ConfigSectionMap(Config, 'pushover')['pushovertoken']
-            self.pushoveruser = ConfigSectionMap(Config, 'pushover')['pushoveruser']
-        else:
-            self.pushovertoken = ''
-            self.pushoveruser = ''
+                self.smtpserver = ''
+                self.smtpport = 1
+                self.smtpuser = ''
+                self.smtppassword = ''
+                self.encryptmail = False
+                self.gnupghome = ''
+                self.targetfingerprint = ''
+                self.targetfingerprints = []
+                self.sourceemail = ''
+
+                self.destemail = ''
+                self.destemails = []
+            self.pushover = Config.getboolean('pushover', 'pushover')
+            if self.pushover:
+                pushoversection = ConfigSectionMap(Config, 'pushover')
+                self.pushovertoken = pushoversection['pushovertoken']
+                self.pushoveruser = pushoversection['pushoveruser']
+            else:
+                self.pushovertoken = ''
+                self.pushoveruser = ''
+
+            self.reviewpath = ConfigSectionMap(Config, 'review')['reviewpath']
+            self.reviewagenda = Config.getboolean('review', 'reviewagenda')
+            self.reviewprojects = Config.getboolean('review', 'reviewprojects')
+            self.reviewcustomers = Config.getboolean('review', 'reviewcustomers')
+            self.reviewwaiting = Config.getboolean('review', 'reviewwaiting')
+            self.reviewmaybe = Config.getboolean('review', 'reviewmaybe')
+            self.reviewoutputpdf = Config.getboolean('review', 'outputpdf')
+            self.reviewoutputhtml = Config.getboolean('review', 'outputhtml')
+            self.reviewoutputmd = Config.getboolean('review', 'outputmd')
+
+            # optional settings
+            self.cachedir = ConfigOptional(Config, 'tpm', 'cachedir', '')
+            self.parseworkers = ConfigOptional(Config, 'tpm', 'parseworkers', 1)
+            self.rendercachesize = ConfigOptional(Config, 'review', 'rendercachesize', 0)
+            self.htmltemplate = ConfigOptional(Config, 'tpm', 'htmltemplate', '')
+            self.archivesegments = ConfigOptional(Config, 'tpm', 'archivesegments', False)
+            self.archivecompress = ConfigOptional(Config, 'tpm', 'archivecompress', False)
+            self.smtpstarttls = ConfigOptional(Config, 'mail', 'smtpstarttls', True)
+            self.mailtimeout = ConfigOptional(Config, 'mail', 'timeout', 30.0)
+            self.mailretries = ConfigOptional(Config, 'mail', 'retries', 2)
+            self.pushoverurl = ConfigOptional(Config, 'pushover', 'pushoverurl', 'https://api.pushover.net/1/messages.json')
+            self.pushovertimeout = ConfigOptional(Config, 'pushover', 'timeout', 30.0)
+            self.pushoverretries = ConfigOptional(Config, 'pushover', 'retries', 2)
+        except (configparser.Error, KeyError, ValueError) as e:
+            sys.exit("settings - invalid config file {0}: {1}".format(configfile, e))
+
+        # duedelta is handed to datetime.timedelta as keyword
+        if self.duedelta not in ('days', 'weeks'):
+            sys.exit("settings - invalid config file {0}: duedelta must be days or weeks".format(configfile))
+        if self.dueinterval < 0:
+            sys.exit("settings - invalid config file {0}: dueinterval must not be negative".format(configfile))
+        if self.mailretries < 0 or self.pushoverretries < 0:
+            sys.exit("settings - invalid config file {0}: retries must not be negative".format(configfile))
+        if self.rendercachesize < 0:
+            sys.exit("settings - invalid config file {0}: rendercachesize must not be negative".format(configfile))
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("settings are read-only")
+        object.__setattr__(self, name, value)
+
+
+_SETTINGSCACHE = {}
+
+
+def loadSettings(configfile):
+    """returns the settings for a config file; the file is only parsed again
+    if it changed since the last call
 
-        self.reviewpath = ConfigSectionMap(Config, 'review')['reviewpath']
-        self.reviewagenda = Config.getboolean('review', 'reviewagenda')
-        self.reviewprojects = Config.getboolean('review', 'reviewprojects')
-        self.reviewcustomers = Config.getboolean('review', 'reviewcustomers')
-        self.reviewwaiting = Config.getboolean('review', 'reviewwaiting')
-        self.reviewmaybe = Config.getboolean('review', 'reviewmaybe')
-        self.reviewoutputpdf = Config.getboolean('review', 'outputpdf')
-        self.reviewoutputhtml = Config.getboolean('review', 'outputhtml')
-        self.reviewoutputmd = Config.getboolean('review', 'outputmd')
+    :param configfile: the tpm config file
+    :returns: a settings instance
+    """
 
+    path = os.path.abspath(configfile)
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        sys.exit("settings - config file {0} not found: {1}".format(configfile, e))
+    fingerprint = (stat.st_mtime, stat.st_size)
+    cached = _SETTINGSCACHE.get(path)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    sett = settings(path)
+    _SETTINGSCACHE[path] = (fingerprint, sett)
+    return sett
 
 
 def ConfigSectionMap(Config, section):
@@ -229,6 +399,27 @@ def ConfigSectionMap(Config, section):
     return dict1
 
 
+def ConfigOptional(Config, section, option, default):
+    """helper function for optional values in the config file
+
+    :param Config: the parsed configuration file
+    :param section: the section of the value
+    :param option: the name of the value
+    :param default: returned if the value is missing; its type defines how the value is parsed
+    :returns: the relevant value in the config file or default
+    """
+
+    if not Config.has_option(section, option):
+        return default
+    if isinstance(default, bool):
+        return Config.getboolean(section, option)
+    if isinstance(default, int):
+        return Config.getint(section, option)
+    if isinstance(default, float):
+        return Config.getfloat(section, option)
+    return Config.get(section, option)
+
+
 def printDebugOutput(con, prepend):
     """standardized debug output generator - prints tasks to stdout
 
@@ -249,85 +440,133 @@ def printDebugOutput(con, prepend):
         sys.exit("printDebugOutput - An error occurred: {0}".format(e.args[0]))
 
 
-def checkSanity(line):
+def tokenizeTask(line):
+    """walks a task line once and collects all tags
+
+    :param line: the content of the task
+    :returns: dict with the tag names as keys and a list of the tag values as values;
+        the value is None for tags without brackets, e.g. {'prio': ['high'], 'maybe': [None]}
+    """
+
+    tags = {}
+    for match in TAGPATTERN.finditer(line):
+        tags.setdefault(match.group(1), []).append(match.group(2))
+    return tags
+
+
+def tagValue(tags, name):
+    """helper function for the result of tokenizeTask
+
+    :param tags: the tags of a task, as returned by tokenizeTask
+    :param name: the tag name without @
+    :returns: the value of the first occurrence of the tag; None if missing or without value
+    """
+
+    values = tags.get(name)
+    if values:
+        return values[0]
+    return None
+
+
+def parseDate(datestring):
+    """converts a date string to a date
+
+    ISO dates are converted directly, everything else is handed to dateutil;
+    the results are memoized in a cache with at most DATECACHESIZE entries
+
+    :param datestring: the date string, e.g. the value of @start or @due
+    :returns: datetime.date
+    """
+
+    try:
+        return _DATECACHE[datestring]
+    except KeyError:
+        pass
+    match = ISODATEPATTERN.match(datestring)
+    if match:
+        mydate = datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    else:
+        mydate = datetime.datetime.date(dateutil.parser.parse(datestring))
+    if len(_DATECACHE) >= DATECACHESIZE:
+        _DATECACHE.clear()
+    _DATECACHE[datestring] = mydate
+    return mydate
+
+
+def dueSoonLimit(sett):
+    """returns the last day number for which a due date counts as due soon
+
+    :param sett: the tpm settings
+    :returns: day number of TODAY plus DUEINTERVAL DUEDELTA
+    """
+
+    return (TODAY + datetime.timedelta(**{sett.duedelta: sett.dueinterval})).toordinal()
+
+
+def checkSanity(line, tags=None):
     """performs some sanity check on task line
 
     :param line: the content of the task
+    :param tags: the tags of the task as returned by tokenizeTask; tokenized if not given
     :return: true if check throws no errrors
     """
 
-    if '@prio' not in line or '@start' not in line:
+    if tags is None:
+        tags = tokenizeTask(line)
+    if 'prio' not in tags or 'start' not in tags:
         return False
 
-    # check brackets
-    iparens = iter('()')
-    parens = dict(zip(iparens, iparens))
-    closing = parens.values()
-
-    stack = []
-    for c in line:
-        d = parens.get(c, None)
-        if d:
-            stack.append(d)
-        elif c in closing:
-            if not stack or c != stack.pop():
-                return False
-    return not stack
+    # check brackets; only one kind of brackets, so a counter is enough
+    depth = 0
+    for c in BRACKETPATTERN.findall(line):
+        if c == '(':
+            depth += 1
+        elif depth == 0:
+            return False
+        else:
+            depth -= 1
+    return depth == 0
 
 
-def parseInputTask(line, myproject, con, configfile):
-    """adds a new task to the database
+def parseInputTask(line, myproject, sett):
+    """parses a task line into the column values for the tasks table
 
     :param line: the content of the task
-    :param project: the project for the task
-    :param con: the database connection
-    :param configfile: the tpm config file
-    :returns: taskid of the new task in the database
+    :param myproject: the project for the task
+    :param sett: the tpm settings
+    :returns: tuple with the values for TASKCOLUMNS and the tags as returned by tokenizeTask
     """
 
-    cur = con.cursor()
-    sett = settings(configfile)
     project = myproject
     done = False
     repeat = False
     repeatinterval = '-'
-    duedate = '2999-12-31'
-    duesoon = False
-    overdue = False
+    duedate = None
+    dueday = None
+    startday = None
     maybe = False
-    today = False
 
-    if checkSanity(line) is False:
+    tags = tokenizeTask(line)
+    if checkSanity(line, tags) is False:
         project = 'Error'
-        try:
-            cur.execute("insert into tasks (project, taskline) values (?, ?)",
-                        (project, line.strip('\n')))
-        except sqlite3.Error as e:
-            sys.exit("parseInputTask - ERROR - An error occurred: {0}".format(e.args[0]))
-        con.commit()
-        return cur.lastrowid
+        return ((None, None, project, line.strip('\n'), None, None,
+                 None, None, None, None, None, None, None, None), tags)
         # TODO - check that this works at output time - maybe output errors seperately
     else:
-        if '@done' in line:
+        if 'done' in tags:
             done = True
-        if '@maybe' in line:
+        if 'maybe' in tags:
             maybe = True
-        if '@repeat' in line:
+        if tagValue(tags, 'repeat') is not None:
             repeat = True
-            repeatinterval = re.search(r'\@repeat\((.*?)\)', line).group(1)
-        if '@due' in line:
-            duedate = re.search(r'\@due\((.*?)\)', line).group(1)
-            duealert = datetime.datetime.date(dateutil.parser.parse(duedate)) \
-                - datetime.timedelta(**{sett.duedelta: sett.dueinterval})
-            if duealert <= TODAY \
-                    <= datetime.datetime.date(dateutil.parser.parse(duedate)):
-                duesoon = True
-            if datetime.datetime.date(dateutil.parser.parse(duedate)) < TODAY:
-                overdue = True
-
-        if '@prio' in line:
-            priotag = re.search(r'\@prio\((.*?)\)', line).group(1)
-            if '@SOC' in line:
+            repeatinterval = tagValue(tags, 'repeat')
+        if tagValue(tags, 'due') is not None:
+            duedate = tagValue(tags, 'due')
+            dueday = parseDate(duedate).toordinal()
+
+        if 'prio' in tags:
+            priotag = tagValue(tags, 'prio')
+            if 'SOC' in tags:
                 priotag = 0
             elif priotag == 'high':
                 priotag = 1
@@ -337,262 +576,646 @@ def parseInputTask(line, myproject, con, configfile):
                 priotag = 3
         else:
             priotag = None
-        if '@start' in line:
-            starttag = re.search(r'\@start\((.*?)\)', line).group(1)
-            # set today tag
-            if datetime.datetime.date(dateutil.parser.parse(starttag)) == TODAY:
-                today = True
-        else:
-            starttag = None
-        if '@repeat' in line:
-            if '@prio' not in line or '@start' not in line or '@repeat' not in line or '@project' not in line:
+        starttag = tagValue(tags, 'start')
+        if starttag is not None:
+            startday = parseDate(starttag).toordinal()
+        if 'repeat' in tags:
+            if not repeat or 'project' not in tags:
                 project = 'Error'
         # remove multiple spaces, not the leading tabs
         line = re.sub(' +', ' ', line)
-        try:
-            cur.execute("insert into tasks (prio, startdate, project, taskline, done,\
-                repeat, repeatinterval, duedate, duesoon, overdue, maybe, today) values\
-                (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (priotag, starttag, project, line.strip('\n'), done, repeat,
-                repeatinterval, duedate, duesoon, overdue, maybe, today))
-        except sqlite3.Error as e:
-            sys.exit("parseInputTask - An error occurred: {0}".format(e.args[0]))
-        con.commit()
-        return cur.lastrowid
+        # the date dependent flags are set by classifyTasks once all tasks are loaded
+        return ((priotag, starttag, project, line.strip('\n'), done, repeat,
+                 repeatinterval, duedate, False, False, maybe, False, startday, dueday), tags)
 
 
-def parseInputNote(line, taskid, con):
-    """adds a new note to the database; this note requires a valid parent (task)
+def insertRecords(con, tasks, notes, tags=()):
+    """bulk insert of parsed tasks, notes and tags; the caller commits
 
-    :param line: the note field
-    :param taskid: the primary key of the parent task
-    :param con: the database connections
+    :param con: the database connection
+    :param tasks: list of tuples with the taskid followed by the values for TASKCOLUMNS
+    :param notes: list of tuples (taskid, noteline)
+    :param tags: list of tuples (taskid, name, value)
     """
-    # ! todo: entfernen des CRLF am Ende der zeile
 
-    cur = con.cursor()
     try:
-        cur.execute("insert into notes (taskid, noteline) values\
-            (?, ?)", (taskid, line.strip('\n')))
-        con.commit()
+        cur = con.cursor()
+        cur.executemany("insert into tasks (taskid, {0}) values ({1})".format(
+            ', '.join(TASKCOLUMNS), ', '.join('?' * (len(TASKCOLUMNS) + 1))), tasks)
+        cur.executemany("insert into notes (taskid, noteline) values (?, ?)", notes)
+        cur.executemany("insert into tags (taskid, name, value) values (?, ?, ?)", tags)
     except sqlite3.Error as e:
-        sys.exit("parseInputNote - An error occurred: {0}".format(e.args[0]))
+        sys.exit("insertRecords - An error occurred: {0}".format(e.args[0]))
+
+
+def nextTaskId(con):
+    """returns the next free primary key of the tasks table
+
+    :param con: the database connection
+    """
+
+    cursel = con.cursor()
+    cursel.execute("SELECT ifnull(max(taskid), 0) + 1 FROM tasks")
+    return cursel.fetchone()[0]
+
+
+def classifyLines(lines):
+    """classifies the lines of a taskpaper file
+
+    :param lines: iterable of lines, including the line endings
+    :returns: generator of tuples (kind, text) with kind 'project', 'task' or 'note'
+    """
+
+    for line in lines:
+        if not line.strip():
+            continue
+        if line.strip() == '-':
+            continue
+        if ':\n' in line:
+            yield ('project', line.strip()[:-1])
+        elif TASKPATTERN.match(line):
+            yield ('task', line)
+        else:
+            yield ('note', line)
+
+
+def readTaskPaper(tpfile):
+    """reads a taskpaper file line by line and classifies the lines
+
+    the file is read through a buffered, incrementally decoding reader, so
+    memory usage does not depend on the size of the file
+
+    :param tpfile: the path to the taskpaper file
+    :returns: generator of tuples (kind, text) with kind 'project', 'task' or 'note'
+    """
+
+    # newline='\n': split at \n only and return the line endings untranslated
+    with io.open(tpfile, 'r', encoding='utf-8', newline='\n') as f:
+        for record in classifyLines(f):
+            yield record
+
+
+def parseRecords(records, sett, cache=None):
+    """parses the classified lines of a taskpaper file
+
+    :param records: iterable of tuples (kind, text), see classifyLines
+    :param sett: the tpm settings
+    :param cache: optional ParseCache; only new or changed task lines are parsed
+    :returns: generator of tuples ('task', values for TASKCOLUMNS, tags) and ('note', noteline)
+    """
+
+    project = ''
+    for kind, text in records:
+        if kind == 'project':
+            project = text
+        elif kind == 'task':
+            if cache is None:
+                (row, tasktags) = parseInputTask(text, project, sett)
+            else:
+                (row, tasktags) = cache.parseTask(text, project)
+            yield ('task', row, tasktags)
+        else:
+            yield ('note', text.strip('\n'))
+
+
+def findChunks(tpfile, chunklines):
+    """splits a taskpaper file at project lines into chunks of about chunklines lines
+
+    :param tpfile: the path to the taskpaper file
+    :param chunklines: the minimum number of lines per chunk
+    :returns: list of tuples (start, end) with the byte offsets of the chunks
+    """
+
+    chunks = []
+    start = 0
+    position = 0
+    lines = 0
+    with io.open(tpfile, 'rb') as f:
+        for line in f:
+            # the same test for project lines as in classifyLines; ':\n' is plain ascii
+            if lines >= chunklines and b':\n' in line:
+                chunks.append((start, position))
+                start = position
+                lines = 0
+            position += len(line)
+            lines += 1
+    if position > start:
+        chunks.append((start, position))
+    return chunks
+
+
+def parseChunk(chunk):
+    """parses one chunk of a taskpaper file; executed in a worker process
+
+    :param chunk: tuple (tpfile, start, end, sett), see findChunks
+    :returns: list of parsed records, see parseRecords
+    """
+
+    (tpfile, start, end, sett) = chunk
+    with io.open(tpfile, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', newline='\n')
+    return list(parseRecords(classifyLines(lines), sett))
+
+
+def parseChunksParallel(tpfile, sett, workers):
+    """parses a taskpaper file in worker processes; the file is split at project lines
+
+    :param tpfile: the path to the taskpaper file
+    :param sett: the tpm settings
+    :param workers: the number of worker processes
+    :returns: generator of parsed records in the order of the file, see parseRecords
+    """
+
+    chunks = [(tpfile, start, end, sett) for (start, end) in findChunks(tpfile, PARSECHUNKLINES)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for parsed in executor.map(parseChunk, chunks):
+            for record in parsed:
+                yield record
 
 
-def parseInput(tpfile, con, configfile):
+def parseInput(tpfile, con, sett, cache=None, workers=1):
     """parses the taskpaper file and populates the database with the content
 
+    all tasks and notes are written in one transaction, in batches of
+    INSERTBATCH tasks while the file is still being read; the taskids are
+    assigned while parsing, so notes can be linked to their task without a round-trip;
+    afterwards the date dependent flags are set by classifyTasks
+
     :param tpfile: the path to the taskpaper file
     :param con: the database connection
-    :param configfile: the config file for tpm
+    :param sett: the tpm settings
+    :param cache: optional ParseCache; only new or changed task lines are parsed
+    :param workers: with more than one worker and without cache the file is parsed in
+        chunks by parallel worker processes
     """
 
     try:
-        with open(tpfile, 'rb') as f:
-            tplines = f.readlines()
-        project = ''
-        taskid = ''
-
-        for line in tplines:
-            line = line.decode("utf-8")
-            if not line.strip():
-                continue
-            if line.strip() == '-':
-                continue
-            if ':\n' in line:
-                # Project
-                project = line.strip()[:-1]
-                continue
-            elif re.match("\t*-.*", line):
-                # is Task
-                taskid = parseInputTask(line, project, con, configfile)
-            else:
-                # is Note
-                if taskid == '':
-                    # we currently only support notes which are associated to tasks
-                    continue
-                parseInputNote(line, taskid, con)
-        f.close()
+        if workers > 1 and cache is None:
+            parsed = parseChunksParallel(tpfile, sett, workers)
+        else:
+            parsed = parseRecords(readTaskPaper(tpfile), sett, cache)
+        loadRecords(con, parsed)
+        classifyTasks(con, sett)
+        if cache is not None:
+            cache.save()
     except Exception as exc:
         sys.exit("parsing input file to db failed; {0}".format(exc))
 
 
-def removeTags(con):
+def loadRecords(con, parsed):
+    """writes parsed records to the database in one transaction
+
+    :param con: the database connection
+    :param parsed: iterable of parsed records, see parseRecords
+    """
+
+    taskid = ''
+    nextid = nextTaskId(con)
+    tasks = []
+    notes = []
+    tags = []
+
+    for record in parsed:
+        if record[0] == 'task':
+            taskid = nextid
+            nextid += 1
+            tasks.append((taskid,) + tuple(record[1]))
+            for name, values in record[2].items():
+                for value in values:
+                    tags.append((taskid, name, value))
+            if len(tasks) >= INSERTBATCH:
+                insertRecords(con, tasks, notes, tags)
+                tasks = []
+                notes = []
+                tags = []
+        else:
+            if taskid == '':
+                # we currently only support notes which are associated to tasks
+                continue
+            notes.append((taskid, record[1]))
+    insertRecords(con, tasks, notes, tags)
+    con.commit()
+
+
+class ParseCache(object):
+    """on-disk cache for parsed task lines, used by parseInput
+
+    the entries are keyed by a hash of the task line and its project; the parsed
+    rows do not depend on the current date, so an entry stays valid as long as the
+    line is unchanged. Entries for lines which are no longer in the taskpaper
+    file are dropped by save()
+    """
+
+    # increased whenever the format of the cached rows changes; older caches are discarded
+    VERSION = 2
+
+    def __init__(self, cachefile, sett):
+        self.sett = sett
+        self.seen = set()
+        self.changed = {}
+        self.hits = 0
+        self.misses = 0
+        self.con = sqlite3.connect(cachefile)
+        if self.con.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            self.con.execute("DROP TABLE IF EXISTS linecache")
+            self.con.execute("PRAGMA user_version = {0}".format(self.VERSION))
+        self.con.execute('''CREATE TABLE IF NOT EXISTS linecache(
+            hash TEXT PRIMARY KEY,
+            record TEXT
+            )''')
+        self.con.commit()
+        # one query for all entries is much cheaper than one query per line
+        self.entries = dict(self.con.execute("SELECT hash, record FROM linecache"))
+
+    def key(self, line, project):
+        text = '\x00'.join((project, line))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def parseTask(self, line, project):
+        """same as parseInputTask, but served from the cache if possible
+
+        :param line: the content of the task
+        :param project: the project for the task
+        :returns: tuple with the values for TASKCOLUMNS and the tags as returned by tokenizeTask
+        """
+
+        key = self.key(line, project)
+        self.seen.add(key)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            (row, tags) = json.loads(entry)
+            return (tuple(row), tags)
+        self.misses += 1
+        (row, tags) = parseInputTask(line, project, self.sett)
+        self.changed[key] = (row, tags)
+        return (row, tags)
+
+    def save(self):
+        """writes new entries and removes entries for vanished lines"""
+
+        entries = [(key, json.dumps(record)) for key, record in self.changed.items()]
+        try:
+            self.con.executemany("INSERT OR REPLACE INTO linecache (hash, record) values (?, ?)", entries)
+            self.con.execute("CREATE TEMP TABLE IF NOT EXISTS seen(hash TEXT PRIMARY KEY)")
+            self.con.execute("DELETE FROM seen")
+            self.con.executemany("INSERT OR IGNORE INTO seen (hash) values (?)", ((key,) for key in self.seen))
+            self.con.execute("DELETE FROM linecache where hash not in (SELECT hash FROM seen)")
+            self.con.commit()
+        except sqlite3.Error as e:
+            sys.exit("ParseCache - An error occurred: {0}".format(e.args[0]))
+        self.changed = {}
+
+    def close(self):
+        self.con.close()
+
+
+def openParseCache(tpfile, sett):
+    """opens the parse cache for a taskpaper file, if a cache directory is configured
+
+    :param tpfile: the path to the taskpaper file
+    :param sett: the tpm settings
+    :returns: ParseCache or None
+    """
+
+    if not sett.cachedir:
+        return None
+    path = os.path.abspath(tpfile)
+    cachefile = os.path.join(sett.cachedir, '{0}_{1}.sqlite'.format(
+        os.path.splitext(os.path.basename(path))[0], hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]))
+    try:
+        if not os.path.isdir(sett.cachedir):
+            os.makedirs(sett.cachedir)
+        return ParseCache(cachefile, sett)
+    except (OSError, sqlite3.Error) as exc:
+        print("parse cache disabled; {0}".format(exc))
+        return None
+
+
+def classifyTasks(con, sett, commit=True):
+    """set the duesoon, overdue and today flags from the day numbers of the tasks
+
+    the flags are reset first, so the stage can be repeated; the date conditions
+    are range predicates on the indexed day numbers
+
+    :param con: the database connection
+    :param sett: the tpm settings
+    :param commit: commit the transaction
+    """
+
+    today = TODAY.toordinal()
+    try:
+        curup = con.cursor()
+        curup.execute("UPDATE tasks SET duesoon = 0, overdue = 0, today = 0\
+            where duesoon = 1 or overdue = 1 or today = 1")
+        curup.execute("UPDATE tasks SET overdue = 1 where dueday < ?", (today,))
+        curup.execute("UPDATE tasks SET duesoon = 1 where dueday between ? and ?", (today, dueSoonLimit(sett)))
+        curup.execute("UPDATE tasks SET today = 1 where startday = ?", (today,))
+        if commit:
+            con.commit()
+    except sqlite3.Error as e:
+        sys.exit("classifyTasks - An error occurred: {0}".format(e.args[0]))
+
+
+def removeTags(con, commit=True):
     """remove overdue, duesoon and today tags
 
     :param con: the database connection
+    :param commit: commit the transaction; False if called by dailyTransform
     """
 
     try:
-        cursel = con.cursor()
         curup = con.cursor()
-        cursel.execute("SELECT taskid, taskline FROM tasks where taskline like '%@overdue%'\
+        curup.execute("UPDATE tasks SET taskline = removetaskparts(taskline, '@overdue @duesoon @today')\
+            where taskline like '%@overdue%'\
             or taskline like '%@duesoon%'\
             or taskline like '%@today%'")
-        for row in cursel:
-                taskstring = removeTaskParts(row[1], '@overdue @duesoon @today')
-                curup.execute("UPDATE tasks SET taskline=? WHERE taskid=?",
-                             (taskstring, row[0]))
-        con.commit()
+        if commit:
+            con.commit()
     except sqlite3.Error as e:
         sys.exit("removeTags - An error occurred: {0}".format(e.args[0]))
 
 
-def setTags(con):
+def setTags(con, commit=True):
     """set overdue, duesoon and today tags
 
     :param con: the database connection
+    :param commit: commit the transaction; False if called by dailyTransform
     """
 
     try:
-        cursel = con.cursor()
         curup = con.cursor()
-        cursel.execute("SELECT taskid, taskline FROM tasks where overdue = 1")
-        for row in cursel:
-            curup.execute("UPDATE tasks SET taskline=? WHERE taskid=?",
-                         ('{0} @overdue'.format(row[1]), row[0]))
-        cursel.execute("SELECT taskid, taskline FROM tasks where duesoon = 1")
-        for row in cursel:
-            curup.execute("UPDATE tasks SET taskline=? WHERE taskid=?",
-                         ('{0} @duesoon'.format(row[1]), row[0]))
-        cursel.execute("SELECT taskid, taskline FROM tasks where today = 1")
-        for row in cursel:
-            curup.execute("UPDATE tasks SET taskline=? WHERE taskid=?",
-                         ('{0} @today'.format(row[1]), row[0]))
-        con.commit()
+        curup.execute("UPDATE tasks SET taskline = taskline\
+            || CASE WHEN overdue = 1 THEN ' @overdue' ELSE '' END\
+            || CASE WHEN duesoon = 1 THEN ' @duesoon' ELSE '' END\
+            || CASE WHEN today = 1 THEN ' @today' ELSE '' END\
+            where overdue = 1 or duesoon = 1 or today = 1")
+        if commit:
+            con.commit()
     except sqlite3.Error as e:
         sys.exit("setTags - An error occurred: {0}".format(e.args[0]))
 
 
-def archiveDone(con):
+def archiveDone(con, commit=True):
     """check @done and mark for later move to archive
 
     :param con: the database connection
+    :param commit: commit the transaction; False if called by dailyTransform
     """
 
     try:
-        cursel = con.cursor()
         curup = con.cursor()
-        cursel.execute("SELECT taskid, taskline, project FROM tasks where done = 1")
-        for row in cursel:
-            #taskstring = removeTaskParts(row[1], '@done')
-            newtask = '{0} @project({1})'.format(row[1], row[2])
-            curup.execute("UPDATE tasks SET taskline=?, project=? WHERE taskid=?",
-                         (newtask, 'Archive', row[0]))
-        con.commit()
+        # the right hand sides see the values before the update, i.e. the old project
+        curup.execute("UPDATE tasks SET taskline = taskline || ' @project(' || project || ')',\
+            project = 'Archive' where done = 1")
+        if commit:
+            con.commit()
     except sqlite3.Error as e:
         sys.exit("archiveDone - An error occurred: {0}".format(e.args[0]))
 
 
-def archiveMaybe(con):
+def archiveMaybe(con, commit=True):
     """check @maybe and mark for later move to maybe file
 
-    :param con: the database connection"""
+    :param con: the database connection
+    :param commit: commit the transaction; False if called by dailyTransform"""
 
     try:
-        cursel = con.cursor()
         curup = con.cursor()
-        cursel.execute("SELECT taskid, taskline, project FROM tasks where maybe = 1")
-        for row in cursel:
-            taskstring = removeTaskParts(row[1], '@maybe @start @due @prio @project')
-            newtask = '{0} @project({1})'.format(taskstring, row[2])
-            curup.execute("UPDATE tasks SET taskline=?, project=? WHERE taskid=?",
-                         (newtask, 'Maybe', row[0]))
-        con.commit()
+        curup.execute("UPDATE tasks SET\
+            taskline = removetaskparts(taskline, '@maybe @start @due @prio @project') || ' @project(' || project || ')',\
+            project = 'Maybe' where maybe = 1")
+        if commit:
+            con.commit()
     except sqlite3.Error as e:
         sys.exit("archiveMaybe - An error occurred: {0}".format(e.args[0]))
 
 
-def setNoteTag(con):
+def setNoteTag(con, commit=True):
     """set a note tag if task has one or more notes associated
 
-    :param con: the database connection"""
+    :param con: the database connection
+    :param commit: commit the transaction; False if called by dailyTransform"""
 
     try:
-        cursel = con.cursor()
-        cursel2 = con.cursor()
         curup = con.cursor()
-        cursel.execute("SELECT taskid, taskline FROM tasks")
-        for row in cursel:
-            cursel2.execute("SELECT count(*) FROM notes where taskid=?", (row[0],))
-            mycount = cursel2.fetchone()[0]
-            if mycount != 0:
-                if '@note' not in row[1]:
-                    taskstring = '{0} {1}'.format(row[1], '@note')
-                    curup.execute("UPDATE tasks SET taskline=? WHERE taskid=?",
-                                 (taskstring, row[0]))
-        con.commit()
+        curup.execute("UPDATE tasks SET taskline = taskline || ' @note'\
+            where instr(taskline, '@note') = 0\
+            and exists (SELECT 1 FROM notes where notes.taskid = tasks.taskid)")
+        if commit:
+            con.commit()
     except sqlite3.Error as e:
         sys.exit("setNoteTag - An error occurred: {0}".format(e.args[0]))
 
 
-def setRepeat(con):
-    """check repeat statements; instantiate new tasks if startdate + repeat interval = today
+# rules for @repeat: list of tuples (pattern, factory), see registerRecurrence
+RECURRENCERULES = []
+_RECURRENCECACHE = {}
+
+# maximum number of missed occurrences instantiated for one repeat task; a repeat task
+# with more is probably a typo in @start and is moved to the Error project
+MAXCATCHUP = 100
+
+
+def registerRecurrence(pattern, factory):
+    """adds a syntax for the value of @repeat; the rules are tried in the order of registration
+
+    :param pattern: regular expression for the complete value of @repeat
+    :param factory: called with the match object; returns a function which computes
+        the next occurrence from a datetime.date
+    """
+
+    RECURRENCERULES.append((re.compile('(?:{0})$'.format(pattern), re.UNICODE), factory))
+    _RECURRENCECACHE.clear()
+
+
+def intervalRecurrence(match):
+    """the built-in rules: a number followed by d (days), w (weeks) or m (months)"""
+
+    number = int(match.group(1))
+    if match.group(2) == 'm':
+        delta = dateutil.relativedelta.relativedelta(months=number)
+    elif match.group(2) == 'w':
+        delta = datetime.timedelta(weeks=number)
+    else:
+        delta = datetime.timedelta(days=number)
+    return lambda mydate: mydate + delta
+
+
+registerRecurrence(r'([1-9]\d*)([dwm])', intervalRecurrence)
+
 
-    :param con: the database connection"""
+def compileRecurrence(rule):
+    """compiles the value of a @repeat tag; the result is cached per rule
+
+    :param rule: the value of the @repeat tag, e.g. 2w
+    :returns: function which computes the next occurrence from a datetime.date; None for unknown rules
+    """
+
+    try:
+        return _RECURRENCECACHE[rule]
+    except KeyError:
+        pass
+    nextdate = None
+    for pattern, factory in RECURRENCERULES:
+        match = pattern.match(rule.strip())
+        if match:
+            nextdate = factory(match)
+            break
+    _RECURRENCECACHE[rule] = nextdate
+    return nextdate
+
+
+def expandRecurrences(templates):
+    """computes all occurrences up to TODAY for a list of repeat tasks
+
+    the next occurrence of every repeat task is kept in a priority queue, so the
+    occurrences of all tasks are generated in chronological order; a repeat task
+    stops after MAXCATCHUP occurrences
+
+    :param templates: list of tuples (key, start date, function returned by compileRecurrence)
+    :returns: tuple (list of tuples (date of the occurrence, key), set of the keys with
+        more than MAXCATCHUP occurrences)
+    """
+
+    queue = []
+    for seq, (key, startdate, nextdate) in enumerate(templates):
+        following = nextdate(startdate)
+        if startdate < following <= TODAY:
+            queue.append((following, seq, key, nextdate))
+    heapq.heapify(queue)
+    occurrences = []
+    counts = collections.defaultdict(int)
+    overflow = set()
+    while queue:
+        (occurrence, seq, key, nextdate) = queue[0]
+        if counts[key] == MAXCATCHUP:
+            overflow.add(key)
+            heapq.heappop(queue)
+            continue
+        counts[key] += 1
+        occurrences.append((occurrence, key))
+        following = nextdate(occurrence)
+        # a rule which does not advance would never end
+        if occurrence < following <= TODAY:
+            heapq.heapreplace(queue, (following, seq, key, nextdate))
+        else:
+            heapq.heappop(queue)
+    return (occurrences, overflow)
+
+
+def setRepeat(con, commit=True):
+    """check repeat statements; instantiate a new task for every occurrence up to today
+
+    occurrences which were missed, e.g. because there was no daily run for some days,
+    are instantiated as well; the start date of the repeat task is set to the last
+    occurrence. Repeat tasks with an unknown @repeat value or more than MAXCATCHUP
+    missed occurrences are moved to the Error project
+
+    :param con: the database connection
+    :param commit: commit the transaction; False if called by dailyTransform"""
 
     try:
         cursel = con.cursor()
-        curin = con.cursor()
-        curup = con.cursor()
-        cursel.execute("SELECT repeatinterval, startdate, taskline,\
-            prio, duedate, taskid FROM tasks where repeat = 1")
+        cursel.execute("SELECT taskid, taskline, prio, startdate, startday,\
+            duedate, dueday FROM tasks where repeat = 1")
+        rows = {}
+        templates = []
+        errors = []
         for row in cursel:
-            delta = ''
-            intervalnumber = re.search(r'(\d+)[dwm]', row[0]).group(1)
-            typeofinterval = re.search(r'\d+([dwm])', row[0]).group(1)
-            intnum = int(intervalnumber)
-            if 'd' in typeofinterval:
-                delta = 'days'
-            if 'w' in typeofinterval:
-                delta = 'weeks'
-            if 'm' in typeofinterval:
-                delta = 'month'
-            if delta == 'days' or delta == 'weeks':
-                newstartdate = \
-                    datetime.datetime.date(dateutil.parser.parse(row[1])) \
-                    + datetime.timedelta(**{delta: intnum})
-            if delta == 'month':
-                newstartdate = \
-                    datetime.datetime.date(dateutil.parser.parse(row[1])) \
-                    + dateutil.relativedelta.relativedelta(months=intnum)
-
-            # instantiate anything which is older or equal than today
-            if newstartdate <= TODAY:
-                if '@project' in row[2]:
-                    projecttag = re.search(r'\@project\((.*?)\)', row[2]).group(1)
-                else:
-                    projecttag = "Error"
-                # get the relevant information from the task description
-                taskstring = removeTaskParts(row[2], '@repeat @project @start')
-                taskstring = '{0} @start({1})'.format(taskstring, newstartdate)
- 
-                # create new instance of repeat task
-                try:
-                    # ! todo: repeatinterval should be NULL, not '-'
-                    curin.execute("insert into tasks (prio, startdate, project, taskline, done,\
-                        repeat, repeatinterval, duedate, duesoon, overdue, maybe) values\
-                        (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                        (row[3], str(newstartdate), projecttag, taskstring, 0, 0,
-                        '-', row[4], 0, 0, 0))
-                except sqlite3.Error as e:
-                    sys.exit("setRepeat - An error occurred: {0}".format(e.args[0]))
-
-                # remove old start-date in taskstring; add newstartdate as start date instead
-                taskstring = removeTaskParts(row[2], '@start')
-                taskstring = '{0} @start({1})'.format(taskstring, newstartdate)
-
-                try:
-                    # prepare modified entry for repeat-task
-                    curup.execute("UPDATE tasks SET taskline=? WHERE taskid=?",
-                                 (taskstring, row[5]))
-                except sqlite3.Error as e:
-                    sys.exit("setRepeat - An error occurred: {0}".format(e.args[0]))
-        con.commit()
+            tags = tokenizeTask(row[1])
+            nextdate = compileRecurrence(tagValue(tags, 'repeat') or '')
+            if nextdate is None:
+                errors.append((row[0],))
+                continue
+            if row[4] is not None:
+                startdate = datetime.date.fromordinal(row[4])
+            else:
+                startdate = parseDate(row[3])
+            projecttag = tagValue(tags, 'project')
+            if projecttag is None:
+                projecttag = 'Error'
+            rows[row[0]] = (row, projecttag)
+            templates.append((row[0], startdate, nextdate))
+
+        (occurrences, overflow) = expandRecurrences(templates)
+        for key in sorted(overflow):
+            print('repeat task with more than {0} missed occurrences moved to Error; check @start: {1}'.format(
+                MAXCATCHUP, rows[key][0][1].strip()))
+            errors.append((key,))
+        tasks = []
+        tags = []
+        laststart = {}
+        for taskid, (occurrence, key) in enumerate([(occurrence, key) for (occurrence, key) in occurrences
+                                                    if key not in overflow], nextTaskId(con)):
+            (row, projecttag) = rows[key]
+            # get the relevant information from the task description
+            taskstring = '{0} @start({1})'.format(removeTaskParts(row[1], '@repeat @project @start'), occurrence)
+            # ! todo: repeatinterval should be NULL, not '-'
+            tasks.append((taskid, row[2], str(occurrence), projecttag, taskstring, 0, 0,
+                          '-', row[5], 0, 0, 0, 0, occurrence.toordinal(), row[6]))
+            for name, values in tokenizeTask(taskstring).items():
+                for value in values:
+                    tags.append((taskid, name, value))
+            laststart[key] = occurrence
+        insertRecords(con, tasks, [], tags)
+
+        # remove old start-date in taskstring; add the last occurrence as start date instead
+        curup = con.cursor()
+        curup.executemany("UPDATE tasks SET taskline=? WHERE taskid=?",
+                          [('{0} @start({1})'.format(removeTaskParts(rows[key][0][1], '@start'), occurrence), key)
+                           for key, occurrence in laststart.items()])
+        curup.executemany("UPDATE tasks SET project='Error' WHERE taskid=?", errors)
+        if commit:
+            con.commit()
     except sqlite3.Error as e:
         sys.exit("setRepeat - An error occurred: {0}".format(e.args[0]))
 
 
+def dailyTransform(con):
+    """runs the stages of the daily mode in one transaction
+
+    :param con: the database connection
+    """
+
+    for stage in (removeTags, setTags, archiveDone, archiveMaybe, setNoteTag, setRepeat):
+        stage(con, commit=False)
+    con.commit()
+
+
+def collectGroups(con):
+    """reads all tasks and their notes in a single ordered query and groups them by project
+
+    :param con: the database connection
+    :returns: tuple with the list of projects, in the order of createProjectList, and
+        a dict with the project as key and the tasks and notes of the project as text
+    """
+
+    groups = {}
+    firsttask = {}
+    cursel = con.cursor()
+    try:
+        cursel.execute("SELECT tasks.taskid, tasks.project, tasks.taskline, notes.noteline\
+            FROM tasks LEFT JOIN notes USING (taskid)\
+            ORDER BY tasks.prio asc, tasks.startday desc, tasks.taskid asc, notes.noteid asc")
+        lasttask = None
+        for row in cursel:
+            lines = groups.setdefault(row[1], [])
+            if row[0] != lasttask:
+                lasttask = row[0]
+                lines.append('{0}\n'.format(row[2]))
+                if row[0] < firsttask.get(row[1], row[0] + 1):
+                    firsttask[row[1]] = row[0]
+            if row[3] is not None:
+                lines.append('{0}\n'.format(row[3]))
+    except sqlite3.Error as e:
+        sys.exit("collectGroups - An error occurred: {0}".format(e.args[0]))
+    projectlist = sorted(firsttask, key=firsttask.get)
+    return (projectlist, dict((project, ''.join(lines)) for project, lines in groups.items()))
+
+
 def printGroup(con, destination):
     """helper function for printDebug - does the actual debug printing
 
@@ -601,43 +1224,47 @@ def printGroup(con, destination):
     :returns: result as text string
     """
 
-    mytxt = ''
+    mytxt = []
     cursel = con.cursor()
-    cursel2 = con.cursor()
     try:
-        cursel.execute("SELECT taskline, project, prio, startdate, taskid FROM tasks\
-            where project = ? ORDER BY prio asc, startdate desc", (destination,))
+        cursel.execute("SELECT tasks.taskid, tasks.taskline, notes.noteline\
+            FROM tasks LEFT JOIN notes USING (taskid) where tasks.project = ?\
+            ORDER BY tasks.prio asc, tasks.startday desc, tasks.taskid asc, notes.noteid asc", (destination,))
+        lasttask = None
         for row in cursel:
-            mytxt = '{0}{1}\n'.format(mytxt, row[0])
-            cursel2.execute("SELECT noteline FROM notes where taskid=?", (row[4],))
-            for rownote in cursel2:
-                mytxt = '{0}{1}\n'.format(mytxt, rownote[0])
+            if row[0] != lasttask:
+                lasttask = row[0]
+                mytxt.append('{0}\n'.format(row[1]))
+            if row[2] is not None:
+                mytxt.append('{0}\n'.format(row[2]))
     except sqlite3.Error as e:
         sys.exit("printDebugGroup - An error occurred: {0}".format(e.args[0]))
-    return mytxt
+    return ''.join(mytxt)
 
 
-def printDebug(con):
+def printDebug(con, groups=None):
     """writes tasks and notes to stdout; used if debug=True instead of actually writing to output file
 
     :param con: the database connection
+    :param groups: the result of collectGroups; queried if not given
     :returns: the content of the new taskpaper file
     """
 
-    projectlist = createProjectList(con)
-    mytxt = ''
+    if groups is None:
+        groups = collectGroups(con)
+    (projectlist, grouptxt) = groups
+    mytxt = []
     for project in projectlist:
         if project != 'INBOX' and project != 'Repeat' and project != 'Maybe' and project != 'Archive' and project != 'Error':
-            mytxt = '{0}\n{1}:\n'.format(mytxt, project)
-            mytxt = '{0}{1}'.format(mytxt, printGroup(con, project))
-    mytxt = '{0}\nRepeat:\n'.format(mytxt)
-    mytxt = '{0}{1}'.format(mytxt, printGroup(con, 'Repeat'))
-    mytxt = '{0}Error:\n'.format(mytxt)
-    mytxt = '{0}{1}'.format(mytxt, printGroup(con, 'Error'))
-    mytxt = '{0}\nINBOX:\n'.format(mytxt)
-    mytxt = '{0}{1}'.format(mytxt, printGroup(con, 'INBOX'))
-    #mytxt = mytxt.encode("utf-8")
-    return(mytxt)
+            mytxt.append('\n{0}:\n'.format(project))
+            mytxt.append(grouptxt[project])
+    mytxt.append('\nRepeat:\n')
+    mytxt.append(grouptxt.get('Repeat', ''))
+    mytxt.append('Error:\n')
+    mytxt.append(grouptxt.get('Error', ''))
+    mytxt.append('\nINBOX:\n')
+    mytxt.append(grouptxt.get('INBOX', ''))
+    return ''.join(mytxt)
 
 
 def createOutFile(con):
@@ -647,32 +1274,133 @@ def createOutFile(con):
     :returns: the content of the new taskpaper file, archive file and maybe file
     """
 
-    mytxt = printDebug(con)
-    mytxtdone = printGroup(con, 'Archive')
-    mytxtmaybe = printGroup(con, 'Maybe')
+    groups = collectGroups(con)
+    mytxt = printDebug(con, groups)
+    mytxtdone = groups[1].get('Archive', '')
+    mytxtmaybe = groups[1].get('Maybe', '')
 
     return (mytxt, mytxtdone, mytxtmaybe)
 
 
-def createTaskListMaybe(filename):
+# tags removed from the tasks of the maybe list in the review
+MAYBEREMOVELIST = '@start @prio @project @customer @waiting'
+
+
+def maybeLines(lines):
+    """converts lines of the maybe file to the text of the maybe list
+
+    :param lines: iterable of utf-8 encoded lines without line endings
+    :returns: the text; every line is preceded by a newline
+    """
+
+    return ''.join('\n{0}'.format(removeTaskParts(line.decode("utf-8"), MAYBEREMOVELIST)) for line in lines)
+
+
+def renderMaybe(body):
+    """adds the headline to the text of maybeLines; empty if there are no lines"""
+
+    if body == '':
+        return ''
+    return '{0}\n\n{1}\n'.format('## Maybe list:', body)
+
+
+class MaybeCache(object):
+    """incrementally maintained maybe list of an append-only maybe file, used by createTaskListMaybe
+
+    the cache records the byte offset up to which the file was processed, the
+    text of the processed lines and a checksum of the first and the last block
+    before the offset; a review only reads the bytes appended after the offset.
+    If the checksum does not match or the file shrank, it was rewritten and is
+    processed again from the start
+    """
+
+    # increased whenever the format of the cache file changes; older caches are discarded
+    VERSION = 1
+    BLOCKSIZE = 4096
+
+    def __init__(self, cachefile):
+        self.cachefile = cachefile
+        self.reset()
+        try:
+            with io.open(cachefile, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if state.get('version') == self.VERSION:
+            (self.offset, self.checksum, self.body, self.size, self.text) = (
+                state['offset'], state['checksum'], state['body'], state['size'], state['text'])
+
+    def reset(self):
+        self.offset = 0
+        self.checksum = ''
+        self.body = ''
+        # size and maybe list of the file at the last update, including an incomplete last line
+        self.size = -1
+        self.text = ''
+
+    def blockChecksum(self, f, offset):
+        f.seek(0)
+        head = f.read(min(offset, self.BLOCKSIZE))
+        f.seek(max(offset - self.BLOCKSIZE, 0))
+        tail = f.read(offset - f.tell())
+        return hashlib.sha1(head + tail).hexdigest()
+
+    def update(self, filename):
+        """processes the lines appended since the last update
+
+        :param filename: the filename of the maybe file
+        :returns: the text of the maybe list, see renderMaybe
+        """
+
+        with open(filename, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if self.offset and (size < self.offset or self.blockChecksum(f, self.offset) != self.checksum):
+                self.reset()
+            if size == self.size:
+                return self.text
+            f.seek(self.offset)
+            data = f.read()
+            # an incomplete last line is shown, but processed again once it is complete
+            end = data.rfind(b'\n') + 1
+            self.body = '{0}{1}'.format(self.body, maybeLines(data[:end].split(b'\n')[:-1]))
+            self.offset += end
+            self.checksum = self.blockChecksum(f, self.offset)
+        self.size = size
+        self.text = renderMaybe('{0}{1}'.format(self.body, maybeLines([data[end:]] if data[end:] else [])))
+        return self.text
+
+    def save(self):
+        """writes the cache file"""
+
+        state = {'version': self.VERSION, 'offset': self.offset, 'checksum': self.checksum,
+                 'body': self.body, 'size': self.size, 'text': self.text}
+        # json.dumps returns a byte string on python 2; replaceFile writes text
+        replaceFile('{0}'.format(json.dumps(state)), self.cachefile)
+
+
+def createTaskListMaybe(filename, cachedir=''):
     """parses maybe file and generates content as text string
 
     :param filename: the filename of the maybe file
+    :param cachedir: directory for a MaybeCache; empty to read the whole file
     :returns: a text string with content of maybe file
     """
 
-    with open(filename, 'rb') as f:
-        lines = f.readlines()
-    mytxt = ''
-    for line in lines:
-        line = line.decode("utf-8")
-        taskstring = removeTaskParts(line.strip('\n'), '@start @prio @project @customer @waiting')
-        mytxt = '{0}\n{1}'.format(mytxt, taskstring)
-    f.close()
-    if mytxt != '':
-        mytxt = '{0}\n\n{1}\n'.format('## Maybe list:', mytxt)
-    else:
-        mytxt = ''
+    if not cachedir:
+        with open(filename, 'rb') as f:
+            return renderMaybe(maybeLines(line.rstrip(b'\n') for line in f))
+
+    path = os.path.abspath(filename)
+    cache = MaybeCache(os.path.join(cachedir, '{0}_{1}.json'.format(
+        os.path.splitext(os.path.basename(path))[0], hashlib.sha1(path.encode('utf-8')).hexdigest()[:8])))
+    mytxt = cache.update(filename)
+    try:
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        cache.save()
+    except (IOError, OSError) as exc:
+        print("maybe cache not updated; {0}".format(exc))
     return mytxt
 
 
@@ -687,8 +1415,8 @@ def createTaskListOverdue(con):
         mytxt = ''
         cursel = con.cursor()
         cursel.execute("SELECT taskline, project, prio, startdate FROM tasks\
-            where overdue = 1 and project != 'Repeat' and project != 'Error' and\
-            done = 0 ORDER BY prio asc, startdate desc ")
+            where dueday < ? and project != 'Repeat' and project != 'Error' and\
+            done = 0 ORDER BY prio asc, startday desc, taskid asc", (TODAY.toordinal(),))
         for row in cursel:
             taskstring = removeTaskParts(row[0], '@start @prio')
             mytxt = '{0}{1}\n'.format(mytxt, taskstring)
@@ -712,8 +1440,8 @@ def createTaskListHigh(con):
         cursel = con.cursor()
         cursel.execute("SELECT taskline, project, prio, startdate FROM tasks\
             where prio = 1 and project != 'Repeat' and project != 'Error' and\
-            startdate <= date( julianday(date('now'))) and done = 0 ORDER BY prio asc,\
-            startdate desc ")
+            startday <= ? and done = 0 ORDER BY prio asc,\
+            startday desc, taskid asc", (TODAY.toordinal(),))
         for row in cursel:
             taskstring = removeTaskParts(row[0], '@start @prio')
             mytxt = '{0}{1}\n'.format(mytxt, taskstring)
@@ -725,9 +1453,17 @@ def createTaskListHigh(con):
         sys.exit("createTaskListHigh - An error occurred: {0}".format(e.args[0]))
 
 
+# the row of the first value of a tag in a task; a task is only listed under this value
+FIRSTTAGVALUE = "SELECT min(first.rowid) FROM tags AS first\
+    where first.taskid = tags.taskid and first.name = tags.name and first.value is not NULL"
+
+
 def createTaskList(con, element, headline, mylist):
     """create a list of tasks for specified content
 
+    all groups are built from a single ordered query, bucketed by tag value;
+    a task with the tag repeated is only listed under its first value
+
     :param con: the database connection
     :param element: the tag to use
     :param headline: the headline to use for the output
@@ -735,31 +1471,27 @@ def createTaskList(con, element, headline, mylist):
     :returns: text string with task list
     """
 
-    mytasks = '\n\n## {0}\n'.format(headline)
-    for listelement in mylist:
-        mytasks = '{0}\n\n### {1}\n'.format(mytasks, listelement)
-        try:
-            cursel = con.cursor()
-            cursel.execute("SELECT taskline, project FROM tasks where project != 'Repeat' and project != 'Error'\
-                ORDER BY prio asc, startdate desc ")
-            for row in cursel:
-                if '@{0}'.format(element) in row[0]:
-                    if re.search(r'\@' + element + '\((.*?)\)', row[0]).group(1) == listelement:
-                        taskstring = removeTaskParts(row[0], '@start @prio @project @customer @waiting')
-                        mytasks = '{0}\n{1}'.format(mytasks, taskstring)
-        except sqlite3.Error as e:
-            sys.exit("createTaskList - An error occurred: {0}".format(e.args[0]))
-    return mytasks
+    buckets = {}
+    try:
+        cursel = con.cursor()
+        cursel.execute("SELECT tags.value, tasks.taskline FROM tags JOIN tasks USING (taskid)\
+            where tags.name = ? and tags.rowid = ({0}) and tasks.project != 'Repeat' and tasks.project != 'Error'\
+            ORDER BY tasks.prio asc, tasks.startday desc, tasks.taskid asc".format(FIRSTTAGVALUE), (element,))
+        for row in cursel:
+            taskstring = removeTaskParts(row[1], '@start @prio @project @customer @waiting')
+            buckets.setdefault(row[0], []).append('\n{0}'.format(taskstring))
+    except sqlite3.Error as e:
+        sys.exit("createTaskList - An error occurred: {0}".format(e.args[0]))
 
+    mytasks = ['\n\n## {0}\n'.format(headline)]
+    for listelement in mylist:
+        mytasks.append('\n\n### {0}\n'.format(listelement))
+        mytasks.extend(buckets.get(listelement, []))
+    return ''.join(mytasks)
 
-def markdown2html(mytext):
-    """convert markdown text to html output
 
-    :param text: input text
-    :returns: the html output
-    """
-
-    TEMPLATE = """<!DOCTYPE html>
+# the html page for the review and the daily mail; the html of the markdown text is inserted as content
+REVIEWTEMPLATE = """<!DOCTYPE html>
     <html>
     <head>
         <link href="http://netdna.bootstrapcdn.com/twitter-bootstrap/2.3.0/css/bootstrap-combined.min.css" rel="stylesheet">
@@ -788,11 +1520,88 @@ def markdown2html(mytext):
     </html>
     """
 
-    #extensions = ['extra', 'smartypants']
-    extensions = ['extra']
-    html = markdown.markdown(mytext, extensions=extensions, output_format='html5')
-    doc = jinja2.Template(TEMPLATE).render(content=html)
-    return doc
+
+_RENDERERS = {}
+
+
+class Renderer(object):
+    """converts markdown text to html pages based on a jinja2 template
+
+    the template is compiled once and a single markdown.Markdown instance is
+    reset and reused for all texts, so instances must not be shared between
+    threads; use getRenderer() to get the instance for a template file
+    """
+
+    def __init__(self, templatefile='', cachedir=''):
+        if templatefile:
+            # templates are recompiled when the file changes; the compiled code is
+            # kept in the bytecode cache, so other processes do not compile again
+            if cachedir:
+                bytecodecache = jinja2.FileSystemBytecodeCache(cachedir)
+            else:
+                bytecodecache = jinja2.FileSystemBytecodeCache()
+            path = os.path.abspath(templatefile)
+            self.environment = jinja2.Environment(loader=jinja2.FileSystemLoader(os.path.dirname(path)),
+                                                  bytecode_cache=bytecodecache, auto_reload=True)
+            self.templatename = os.path.basename(path)
+            self.template = None
+        else:
+            self.environment = jinja2.Environment()
+            self.template = self.environment.from_string(REVIEWTEMPLATE)
+        #extensions = ['extra', 'smartypants']
+        self.markdown = markdown.Markdown(extensions=['extra'], output_format='html5')
+
+    def render(self, mytext):
+        self.markdown.reset()
+        html = self.markdown.convert(mytext)
+        template = self.template
+        if template is None:
+            template = self.environment.get_template(self.templatename)
+        return template.render(content=html)
+
+
+def getRenderer(templatefile='', cachedir=''):
+    """returns the shared Renderer for a template file
+
+    :param templatefile: path to a jinja2 template; empty for REVIEWTEMPLATE
+    :param cachedir: directory for the bytecode cache of the template; empty for the default
+    """
+
+    key = (templatefile, cachedir)
+    renderer = _RENDERERS.get(key)
+    if renderer is None:
+        renderer = Renderer(templatefile, cachedir)
+        _RENDERERS[key] = renderer
+    return renderer
+
+
+def templateVersion(templatefile=''):
+    """returns a hash of the template used by markdown2html
+
+    :param templatefile: path to a jinja2 template; empty for REVIEWTEMPLATE
+    """
+
+    if templatefile:
+        with open(templatefile, 'rb') as f:
+            source = f.read()
+    else:
+        source = REVIEWTEMPLATE.encode('utf-8')
+    return hashlib.sha1(source).hexdigest()
+
+
+def markdown2html(mytext, templatefile='', cachedir=''):
+    """convert markdown text to html output
+
+    :param text: input text
+    :param templatefile: path to a jinja2 template with the variable content; empty for REVIEWTEMPLATE
+    :param cachedir: directory for the bytecode cache of the template
+    :returns: the html output
+    """
+
+    try:
+        return getRenderer(templatefile, cachedir).render(mytext)
+    except (jinja2.TemplateError, IOError, OSError) as e:
+        sys.exit("markdown2html - An error occurred: {0}".format(e))
 
 
 def html2pdf(html, outfile):
@@ -809,31 +1618,218 @@ def html2pdf(html, outfile):
     mydoc.write_pdf(target=outfile)
 
 
-def sendPushover(content, configfile):
+class NotificationError(Exception):
+    """a notification was rejected; status is the HTTP status, if any"""
+
+    def __init__(self, message, status=None):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def sendPushover(content, sett, timeout=30.0):
     """send text to pushover service via http-request
 
     :param content: the text for the poushover message
-    :param configfile: the tpm config file
+    :param sett: the tpm settings
+    :param timeout: timeout in seconds for every network operation
+    :raises: NotificationError if the message was rejected; socket and http errors
     """
 
-    sett = settings(configfile)
     content = content.encode("utf-8")
+    url = urlsplit(sett.pushoverurl)
+    if url.scheme == 'http':
+        conn = http_client.HTTPConnection(url.netloc, timeout=timeout)
+    else:
+        conn = http_client.HTTPSConnection(url.netloc, timeout=timeout)
     try:
-        #conn = httplib.HTTPSConnection("api.pushover.net:443")
-        conn = http_client.HTTPSConnection("api.pushover.net:443")
-        conn.request("POST", "/1/messages.json",
-            urllib.urlencode({
+        conn.request("POST", url.path,
+            urlencode({
                 "token": sett.pushovertoken,
                 "user": sett.pushoveruser,
                 "message": content,
             }), {"Content-type": "application/x-www-form-urlencoded"})
-        conn.getresponse()
-    except Exception as exc:
-        sys.exit("sending pushover message failed; {0}".format(exc))
+        response = conn.getresponse()
+        response.read()
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise NotificationError('pushover returned {0} {1}'.format(response.status, response.reason),
+                                response.status)
+
+
+_MAILTRANSPORTS = {}
+
+
+class TrackingSMTP(smtplib.SMTP):
+    """smtplib.SMTP which records if the DATA command of the current message was sent"""
+
+    datasent = False
+
+    def data(self, msg):
+        self.datasent = True
+        return smtplib.SMTP.data(self, msg)
+
+
+class MailTransport(object):
+    """an authenticated smtp connection which is kept open for all mails of a run
+
+    the connection is opened for the first mail; if the server closed it in the
+    meantime, it is opened again. A message is only sent again if the connection
+    was lost before its DATA command; afterwards the server may have accepted it.
+    Use getMailTransport() to get the shared instance for a server; the
+    instances are thread-safe
+    """
+
+    def __init__(self, sett, timeout):
+        self.sett = sett
+        self.timeout = timeout
+        self.conn = None
+        self.connects = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        sett = self.sett
+        conn = TrackingSMTP(sett.smtpserver, sett.smtpport, timeout=self.timeout)
+        try:
+            if sett.debug:
+                conn.set_debuglevel(True)
+            else:
+                conn.set_debuglevel(False)
+            if sett.smtpstarttls:
+                conn.starttls()
+            if sett.smtpuser:
+                conn.login(sett.smtpuser, sett.smtppassword)
+        except Exception:
+            conn.close()
+            raise
+        self.conn = conn
+        self.connects += 1
+
+    def send(self, sender, receivers, message):
+        """sends one message; reconnects once if the connection was lost
+
+        :param sender: the sender email address
+        :param receivers: list of receiver email addresses
+        :param message: the message as string
+        :returns: dict of refused receivers, see smtplib.SMTP.sendmail
+        :raises: NotificationError if the connection was lost after DATA; the message is not sent again
+        """
+
+        with self.lock:
+            reconnected = False
+            while True:
+                if self.conn is None:
+                    self.connect()
+                    reconnected = True
+                self.conn.datasent = False
+                try:
+                    return self.conn.sendmail(sender, receivers, message)
+                except smtplib.SMTPServerDisconnected:
+                    pass
+                except smtplib.SMTPException:
+                    raise
+                except socket.error:
+                    pass
+                datasent = self.conn.datasent
+                self.reset()
+                if datasent:
+                    raise NotificationError('connection lost after the message was sent; it may have been delivered')
+                if reconnected:
+                    raise smtplib.SMTPServerDisconnected('connection lost while sending')
+
+    def reset(self):
+        """drops the connection without goodbye"""
+
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            finally:
+                self.conn = None
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                try:
+                    self.conn.quit()
+                except (smtplib.SMTPException, socket.error):
+                    pass
+                self.reset()
+
+
+def getMailTransport(sett, timeout):
+    """returns the shared MailTransport for the smtp server and user of the settings
+
+    :param sett: the tpm settings
+    :param timeout: timeout in seconds for every network operation
+    """
+
+    key = (sett.smtpserver, sett.smtpport, sett.smtpuser, sett.smtpstarttls, timeout)
+    transport = _MAILTRANSPORTS.get(key)
+    if transport is None:
+        transport = _MAILTRANSPORTS.setdefault(key, MailTransport(sett, timeout))
+    return transport
+
+
+def closeMailTransports():
+    """closes all smtp connections opened by sendMail"""
+
+    for transport in list(_MAILTRANSPORTS.values()):
+        transport.close()
+    _MAILTRANSPORTS.clear()
+
+
+_GPGHANDLES = {}
+_GPGLOCK = threading.Lock()
+
+
+def getGPG(gnupghome):
+    """returns the gnupg handle for a keyring; it is created once per process
+
+    :param gnupghome: the path to the .gnupg directory
+    """
+
+    with _GPGLOCK:
+        gpg = _GPGHANDLES.get(gnupghome)
+        if gpg is None:
+            gpg = gnupg.GPG(gnupghome=gnupghome)
+            gpg.encoding = 'utf-8'
+            _GPGHANDLES[gnupghome] = gpg
+    return gpg
+
+
+def encryptContent(content, sett):
+    """encrypts a text for all keys in targetfingerprint in one gpg operation
+
+    :param content: the text to encrypt
+    :param sett: the tpm settings
+    :returns: the ascii armored encrypted text
+    :raises: NotificationError if encryption is not configured or gpg failed
+    """
+
+    if not sett.encryptmail:
+        raise NotificationError("encryption required, but not set in config file")
+    contentenc = getGPG(sett.gnupghome).encrypt(content.encode("utf-8"), sett.targetfingerprints, always_trust=True)
+    if not contentenc.ok:
+        raise NotificationError('encryption failed; {0}'.format(contentenc.status))
+    return str(contentenc)
 
 
-def sendMail(content, subject, sender, receiver, text_subtype, encrypted, configfile):
-    """sends email directly via starttls connection to smtp server
+def sendEncryptedMail(encryption, subject, sender, receiver, sett, timeout=30.0):
+    """sends a mail with a text encrypted by encryptContent
+
+    :param encryption: future of encryptContent; one encryption is shared by all receivers
+    :param subject: the subject of the mail
+    :param sender: the sender email address
+    :param receiver: the receiver email address
+    :param sett: the tpm settings
+    :param timeout: timeout in seconds for every network operation
+    """
+
+    sendMessage(email.mime.text.MIMEText(encryption.result(), 'plain'), subject, sender, receiver, sett, timeout)
+
+
+def sendMail(content, subject, sender, receiver, text_subtype, encrypted, sett, timeout=30.0):
+    """sends email via the shared connection to the smtp server, see MailTransport
 
     :param content: the text messages for the mail
     :param subject: the subject of the mail
@@ -841,62 +1837,127 @@ def sendMail(content, subject, sender, receiver, text_subtype, encrypted, config
     :param receiver: the receiver email address
     :param text_subtype: the MIME type for the email
     :param encrypted: boolean - encrypt the mail with gpg?
-    :param configfile: the tpm config file
+    :param sett: the tpm settings
+    :param timeout: timeout in seconds for every network operation
+    :raises: NotificationError if encryption is not configured or failed; smtplib and socket errors
     """
 
-    sett = settings(configfile)
-    content = content.encode("utf-8")
-    try:
-        if encrypted is False:
-            msg = email.mime.text.MIMEText(content, text_subtype)
-        elif encrypted is True:
-            if sett.encryptmail:
-                gpg = gnupg.GPG(gnupghome=sett.gnupghome)
-                gpg.encoding = 'utf-8'
-                contentenc = gpg.encrypt(content, sett.targetfingerprint, always_trust=True)
-                msg = email.mime.text.MIMEText(str(contentenc), text_subtype)
-            else:
-                raise "encryption required, but not set in config file"
-        msg['Subject'] = subject
-        msg['From'] = sender
+    if encrypted is False:
+        msg = email.mime.text.MIMEText(content, text_subtype, 'utf-8')
+    elif encrypted is True:
+        msg = email.mime.text.MIMEText(encryptContent(content, sett), text_subtype)
+    sendMessage(msg, subject, sender, receiver, sett, timeout)
 
-        conn = smtplib.SMTP(sett.smtpserver, sett.smtpport)
-        conn.starttls()
-        if sett.debug:
-            conn.set_debuglevel(True)
-        else:
-            conn.set_debuglevel(False)
-        conn.login(sett.smtpuser, sett.smtppassword)
+
+def sendMessage(msg, subject, sender, receiver, sett, timeout=30.0):
+    """adds the headers to a MIME message and sends it via the shared connection to the smtp server
+
+    :param msg: the MIME message
+    :param subject: the subject of the mail
+    :param sender: the sender email address
+    :param receiver: the receiver email address
+    :param sett: the tpm settings
+    :param timeout: timeout in seconds for every network operation
+    """
+
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = receiver
+
+    getMailTransport(sett, timeout).send(sender, [receiver], msg.as_string())
+
+
+# the result of sendNotifications for one channel; error is None if ok
+NotificationResult = collections.namedtuple('NotificationResult', 'channel ok attempts seconds error')
+
+
+def transientError(exc):
+    """decides if a failed notification is worth a retry
+
+    :param exc: the exception raised by sendMail or sendPushover
+    :returns: True for timeouts, connection problems and temporary server errors
+    """
+
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 400 <= exc.smtp_code < 500
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return False
+    if isinstance(exc, NotificationError):
+        return exc.status is not None and (exc.status >= 500 or exc.status == 429)
+    return isinstance(exc, (socket.error, smtplib.SMTPServerDisconnected, http_client.HTTPException))
+
+
+def deliverNotification(notification):
+    """sends one notification; transient errors are retried with exponential backoff
+
+    :param notification: tuple (channel, function, args, timeout, retries); the function
+        is called with args and the timeout as keyword
+    :returns: NotificationResult
+    """
+
+    (channel, function, args, timeout, retries) = notification
+    start = time.time()
+    attempt = 0
+    while True:
+        attempt += 1
         try:
-            conn.sendmail(sender, receiver, msg.as_string())
-        finally:
-            conn.close()
+            function(*args, timeout=timeout)
+            return NotificationResult(channel, True, attempt, time.time() - start, None)
+        except Exception as exc:
+            if attempt > retries or not transientError(exc):
+                return NotificationResult(channel, False, attempt, time.time() - start,
+                                          '{0}: {1}'.format(type(exc).__name__, exc))
+        time.sleep(NOTIFYBACKOFF * 2 ** (attempt - 1))
 
-    except Exception as exc:
-        sys.exit("sending email failed; {0}".format(exc))
 
+def sendNotifications(notifications):
+    """sends all notifications concurrently, one thread per channel
 
-def createMail(con, configfile):
+    failures do not end the program; they are returned as results
+
+    :param notifications: list of tuples (channel, function, args, timeout, retries)
+    :returns: list of NotificationResult, in the order of notifications
+    """
+
+    if not notifications:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(notifications)) as executor:
+        return list(executor.map(deliverNotification, notifications))
+
+
+def failedNotifications(results):
+    """summarizes the failed notifications of runFile
+
+    :param results: list of NotificationResult; None in review mode
+    :returns: a message naming every failed channel; empty if all were sent
+    """
+
+    return '; '.join('sending {0} failed; {1}'.format(result.channel, result.error)
+                     for result in results or () if not result.ok)
+
+
+def createMail(con, sett):
     """create text for email output
 
     :param con: the database connection
-    :param configfile: the tpm config file
+    :param sett: the tpm settings
     """
 
     # ToDo: Funktion statt direkten select verwenden
 
-    sett = settings(configfile)
     if sett.sendmail:
         try:
             cursel = con.cursor()
+            today = TODAY.toordinal()
+            soon = dueSoonLimit(sett)
 
             mytxtasc = '# Tasks for Today\n'
             mytxtasc = '{0}\n## Overdue tasks\n'.format(mytxtasc)
 
             # Overdue
             cursel.execute("SELECT taskline, project, prio, startdate, duedate FROM tasks\
-                where overdue = 1 and done = 0 and project != 'Repeat' and project != 'Error' ORDER BY prio asc,\
-                startdate desc ")
+                where dueday < ? and done = 0 and project != 'Repeat' and project != 'Error' ORDER BY prio asc,\
+                startday desc, taskid asc", (today,))
             for row in cursel:
                 taskstring = removeTaskParts(row[0], '@')
                 taskstring = '{0} @due({1})'.format(taskstring, row[4])
@@ -905,8 +1966,8 @@ def createMail(con, configfile):
 
             # Due soon
             cursel.execute("SELECT taskline, project, prio, startdate, duedate FROM tasks\
-                where duesoon = 1 and project != 'Repeat' and project != 'Error' and done = 0 ORDER BY prio asc,\
-                startdate desc ")
+                where dueday between ? and ? and project != 'Repeat' and project != 'Error' and done = 0 ORDER BY prio asc,\
+                startday desc, taskid asc", (today, soon))
             for row in cursel:
                 taskstring = removeTaskParts(row[0], '@')
                 taskstring = '{0} @due({1})'.format(taskstring, row[4])
@@ -916,12 +1977,12 @@ def createMail(con, configfile):
 
             # All other high prio tasks
             cursel.execute("SELECT taskline, project, prio, startdate, duedate FROM tasks\
-                where prio = 1 and duesoon = 0 and overdue = 0 and project != 'Repeat' and project != 'Error' and\
-                startdate <= date( julianday(date('now'))) and done = 0 ORDER BY prio asc,\
-                startdate desc ")
+                where prio = 1 and (dueday is null or dueday > ?) and project != 'Repeat' and project != 'Error' and\
+                startday <= ? and done = 0 ORDER BY prio asc,\
+                startday desc, taskid asc", (soon, today))
             for row in cursel:
                 taskstring = removeTaskParts(row[0], '@start @prio')
-                if row[4] != '2999-12-31':
+                if row[4] is not None:
                     taskstring = '{0} @due({1})'.format(taskstring, row[4])
                 mytxtasc = '{0}{1}\n'.format(mytxtasc, taskstring.strip())
 
@@ -940,15 +2001,16 @@ def createUniqueList(con, element):
      """
 
     mylist = []
+    seen = set()
     try:
         cursel = con.cursor()
-        cursel.execute("SELECT taskline, project FROM tasks\
-            ORDER BY prio asc, startdate desc ")
+        cursel.execute("SELECT tags.value FROM tags JOIN tasks USING (taskid)\
+            where tags.name = ? and tags.rowid = ({0})\
+            ORDER BY tasks.prio asc, tasks.startday desc, tasks.taskid asc".format(FIRSTTAGVALUE), (element,))
         for row in cursel:
-            if '@{0}'.format(element) in row[0]:
-                mycontent = re.search(r'\@' + element + '\((.*?)\)', row[0]).group(1)
-                if mycontent not in mylist:
-                    mylist.append(mycontent)
+            if row[0] not in seen:
+                seen.add(row[0])
+                mylist.append(row[0])
     except sqlite3.Error as e:
         sys.exit("createUniqueList - An error occurred: {0}".format(e.args[0]))
     return mylist
@@ -963,7 +2025,7 @@ def createProjectList(con):
     mylist = []
     try:
         cursel = con.cursor()
-        cursel.execute("SELECT DISTINCT project FROM tasks")
+        cursel.execute("SELECT project FROM tasks GROUP BY project ORDER BY min(taskid)")
         for row in cursel:
             mylist.append(row[0])
     except sqlite3.Error as e:
@@ -971,38 +2033,539 @@ def createProjectList(con):
     return mylist
 
 
+def writeText(outfile, mytext):
+    """writes a text in pieces of WRITEBUFFER characters, so it is never encoded as a whole
+
+    :param outfile: a file opened in text mode
+    :param mytext: the text to write
+    """
+
+    for start in range(0, len(mytext), WRITEBUFFER):
+        outfile.write(mytext[start:start + WRITEBUFFER])
+
+
+def syncDirectory(dirname):
+    """flushes a rename in dirname to disk; not possible on all platforms"""
+
+    try:
+        fd = os.open(dirname, os.O_RDONLY)
+    except (OSError, AttributeError):
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def createTempFile(filename):
+    """creates an empty temp file next to filename
+
+    the file is created with the permissions open() would give a new file,
+    i.e. 0o666 minus the umask
+
+    :param filename: the target filename
+    :returns: tuple (file descriptor, path of the temp file)
+    """
+
+    dirname = os.path.dirname(os.path.abspath(filename))
+    while True:
+        tmpname = os.path.join(dirname, '.{0}.{1}.tmp'.format(os.path.basename(filename),
+                                                               hashlib.sha1(os.urandom(16)).hexdigest()[:12]))
+        try:
+            return (os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666), tmpname)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+
+def replaceFile(mytext, filename):
+    """writes a file atomically: a temp file in the same directory is written,
+    fsynced and renamed to filename
+
+    the target is not touched if its content is unchanged, so sync clients do
+    not see a new version; a crash leaves either the old or the new file
+
+    :param mytext: the new content of the file
+    :param filename: the target filename
+    :returns: False if the file was unchanged
+    """
+
+    dirname = os.path.dirname(os.path.abspath(filename))
+    (fd, tmpname) = createTempFile(filename)
+    try:
+        with io.open(fd, 'w', encoding='utf-8', newline='', buffering=WRITEBUFFER) as outfile:
+            writeText(outfile, mytext)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        if os.path.isfile(filename) and filecmp.cmp(tmpname, filename, shallow=False):
+            os.remove(tmpname)
+            return False
+        if os.path.exists(filename):
+            shutil.copymode(filename, tmpname)
+        getattr(os, 'replace', os.rename)(tmpname, filename)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+    syncDirectory(dirname)
+    return True
+
+
+def appendFile(mytext, filename):
+    """appends a text through one buffered handle and fsyncs the file
+
+    :param mytext: the text to append
+    :param filename: the target filename; created if it does not exist
+    """
+
+    with io.open(filename, 'a', encoding='utf-8', newline='', buffering=WRITEBUFFER) as outfile:
+        writeText(outfile, mytext)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+
 def myFile(mytext, filename, mode):
     """helper function for file operations; append and write
 
     :param mytext: text for file write
     :param filename: the target filename
-    :param mode: 'w' for write new and 'a' for append existing
+    :param mode: 'w' for write new and 'a' for append existing; 'b' is ignored, the files are always utf-8
     """
 
     try:
-        mytext = mytext.encode("utf-8")
-        outfile = open(filename, mode)
-        outfile.write(mytext)
-        outfile.close()
+        if 'a' in mode:
+            appendFile(mytext, filename)
+        else:
+            replaceFile(mytext, filename)
     except Exception as exc:
         sys.exit("file operation failed; {0}".format(exc))
 
 
-def main():
-    (inputfile, configfile, modus, backup) = parseArgs(sys.argv[1:])
+def archiveDir(inputfile):
+    """returns the directory of the segmented archive of a taskpaper file"""
+
+    return '{0}/{1}_archive'.format(os.path.dirname(os.path.abspath(inputfile)),
+                                    os.path.splitext(os.path.basename(inputfile))[0])
+
+
+def splitTasks(lines):
+    """groups lines of archived tasks into tasks
+
+    :param lines: iterable of lines, including the line endings
+    :returns: generator of texts, each a task line followed by its notes
+    """
+
+    task = []
+    for line in lines:
+        if TASKPATTERN.match(line) and task:
+            yield ''.join(task)
+            task = []
+        task.append(line)
+    if task:
+        yield ''.join(task)
+
+
+def archiveTaskInfo(task):
+    """returns what the archive index knows about an archived task
+
+    :param task: the task line, optionally followed by its notes
+    :returns: tuple (done date, project, tags); the done date is TODAY if @done has no valid date
+    """
+
+    tags = tokenizeTask(task.split('\n', 1)[0])
+    try:
+        done = parseDate(tagValue(tags, 'done'))
+    except (TypeError, ValueError, OverflowError):
+        done = TODAY
+    return (done, tagValue(tags, 'project'), tags)
+
+
+def loadArchiveIndex(archivedir):
+    """reads the index of a segmented archive
+
+    the index maps each segment file to the first and last done date, the
+    projects and the tags with their values of the tasks in the segment
+
+    :param archivedir: the archive directory, see archiveDir
+    :returns: dict segment name -> dict with keys first, last, projects and tags
+    """
+
+    try:
+        with io.open(os.path.join(archivedir, ARCHIVEINDEX), 'r', encoding='utf-8') as f:
+            return json.load(f)['segments']
+    except (IOError, OSError):
+        return {}
+
+
+def appendSegment(mytext, segmentfile):
+    """appends a text to an archive segment; .gz segments get a new gzip member
+
+    :param mytext: the text to append
+    :param segmentfile: the path of the segment
+    """
+
+    if not segmentfile.endswith('.gz'):
+        appendFile(mytext, segmentfile)
+        return
+    with io.open(segmentfile, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='ab') as outfile:
+            for start in range(0, len(mytext), WRITEBUFFER):
+                outfile.write(mytext[start:start + WRITEBUFFER].encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def appendArchive(mytxtdone, archivedir, compress=False):
+    """appends done tasks to the segmented archive, one segment per month of the @done date
+
+    the index is written before the segments, so after a crash it may list
+    more than the segments contain, but never less
+
+    :param mytxtdone: the archived tasks, as returned by createOutFile
+    :param archivedir: the archive directory, see archiveDir
+    :param compress: gzip new segments?
+    """
+
+    segments = collections.OrderedDict()
+    index = loadArchiveIndex(archivedir)
+    for task in splitTasks(mytxtdone.splitlines(True)):
+        (done, project, tags) = archiveTaskInfo(task)
+        segment = '{0:%Y-%m}.txt{1}'.format(done, '.gz' if compress else '')
+        segments.setdefault(segment, []).append(task)
+        entry = index.setdefault(segment, {'first': done.isoformat(), 'last': done.isoformat(),
+                                           'projects': [], 'tags': {}})
+        entry['first'] = min(entry['first'], done.isoformat())
+        entry['last'] = max(entry['last'], done.isoformat())
+        if project is not None and project not in entry['projects']:
+            entry['projects'].append(project)
+        for (name, values) in tags.items():
+            known = entry['tags'].setdefault(name, [])
+            # in order of appearance, so an unchanged archive gives an unchanged index
+            for value in values:
+                if value is not None and value not in known:
+                    known.append(value)
+    if not segments:
+        return
+    if not os.path.isdir(archivedir):
+        os.makedirs(archivedir)
+    # json.dumps returns a byte string on python 2; replaceFile writes text
+    replaceFile('{0}'.format(json.dumps({'segments': index}, indent=1, sort_keys=True)),
+                os.path.join(archivedir, ARCHIVEINDEX))
+    for (segment, tasks) in segments.items():
+        appendSegment(''.join(tasks), os.path.join(archivedir, segment))
+
+
+def matchArchive(first, last, projects, tags, since=None, until=None, project=None, tag=None):
+    """checks a task or an index entry against the search criteria of searchArchive
+
+    :param first: the first done date
+    :param last: the last done date
+    :param projects: the projects
+    :param tags: dict tag name -> list of values
+    :param since, until, project, tag: the search criteria, see searchArchive
+    :returns: True if there is a match
+    """
+
+    if since is not None and last < since:
+        return False
+    if until is not None and first > until:
+        return False
+    if project is not None and project not in projects:
+        return False
+    if tag is not None:
+        (name, value) = tag
+        if name not in tags or (value is not None and value not in tags[name]):
+            return False
+    return True
+
+
+def searchArchive(archivedir, since=None, until=None, project=None, tag=None):
+    """searches the segmented archive; only the segments which may contain matches are read
+
+    :param archivedir: the archive directory, see archiveDir
+    :param since: the first done date, as datetime.date
+    :param until: the last done date, as datetime.date
+    :param project: the project of the tasks
+    :param tag: tuple (tag name, value); value None matches any value
+    :returns: generator of the matching tasks, each with its notes
+    """
+
+    criteria = (since and since.isoformat(), until and until.isoformat(), project, tag)
+    index = loadArchiveIndex(archivedir)
+    for segment in sorted(index):
+        entry = index[segment]
+        if not matchArchive(entry['first'], entry['last'], entry['projects'], entry['tags'], *criteria):
+            continue
+        segmentfile = os.path.join(archivedir, segment)
+        if segment.endswith('.gz'):
+            infile = io.TextIOWrapper(gzip.open(segmentfile, 'rb'), encoding='utf-8', newline='\n')
+        else:
+            infile = io.open(segmentfile, 'r', encoding='utf-8', newline='\n')
+        with infile:
+            for task in splitTasks(infile):
+                (done, taskproject, tags) = archiveTaskInfo(task)
+                if matchArchive(done.isoformat(), done.isoformat(), [taskproject], tags, *criteria):
+                    yield task
+
+
+def createReviewText(con, sett):
+    """creates the review lists from the database; the maybe list is added by runFile
+
+    :param con: the database connection
+    :param sett: the tpm settings
+    :returns: the review as markdown text
+    """
+
+    reviewtext = '# Review\n\n'
+    reviewtext = '{0}\n{1}'.format(reviewtext, createTaskListHigh(con))
+    reviewtext = '{0}\n{1}'.format(reviewtext, createTaskListOverdue(con))
+    if sett.reviewagenda:
+        agendalist = createUniqueList(con, 'agenda')
+        if len(agendalist) > 0:
+            agendatasks = createTaskList(con, 'agenda', 'Agenda', agendalist)
+            reviewtext = '{0}\n{1}'.format(reviewtext, agendatasks)
+    if sett.reviewwaiting:
+        waitinglist = createUniqueList(con, 'waiting')
+        if len(waitinglist) > 0:
+            waitingtasks = createTaskList(con, 'waiting',
+                                          'Waiting For', waitinglist)
+            reviewtext = '{0}\n{1}'.format(reviewtext, waitingtasks)
+    if sett.reviewcustomers:
+        customerlist = createUniqueList(con, 'customer')
+        if len(customerlist) > 0:
+            customertasks = createTaskList(con, 'customer',
+                                           'Customers', customerlist)
+            reviewtext = '{0}\n{1}'.format(reviewtext, customertasks)
+    if sett.reviewprojects:
+        projectlist = createProjectList(con)
+        #if len(projectlist) > 0:
+            # ToDo: das muss über die neue Funktion gemacht werden
+            #projecttasks = createTaskList(con, 'project', 'Projects', projectlist)
+            #reviewtext = '{0}\n{1}'.format(reviewtext, projecttasks)
+    return reviewtext
+
+
+def timedCall(function, *args):
+    """calls function with the given arguments
+
+    :returns: tuple (result of the function, seconds needed)
+    """
+
+    start = time.time()
+    result = function(*args)
+    return (result, time.time() - start)
+
+
+class RenderCache(object):
+    """cache for the html and pdf files of the review, keyed by a hash of the markdown text
+
+    the key includes the version of the html template; the cached files are
+    hard-linked to the review files, so an unchanged review
+    costs neither rendering nor disk space; the least recently used entries are
+    removed when the cache grows beyond maxsize bytes. The use of an entry is
+    recorded in the modification time of a separate stamp file, <key>.used, as
+    the cached files share their inode with the review files
+    """
+
+    def __init__(self, cachedir, maxsize, version=''):
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        self.version = version
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def key(self, reviewtext):
+        text = '{0}\x00{1}\x00{2}'.format(RENDERVERSION, self.version, reviewtext)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def path(self, key, extension):
+        return os.path.join(self.cachedir, '{0}.{1}'.format(key, extension))
+
+    def fetch(self, key, extension, target):
+        """links the cached file to target
+
+        :returns: False if the file is not in the cache
+        """
+
+        cached = self.path(key, extension)
+        if not os.path.isfile(cached):
+            return False
+        linkFile(cached, target)
+        self.touch(key)
+        return True
+
+    def store(self, key, extension, source):
+        """adds a rendered file to the cache"""
+
+        linkFile(source, self.path(key, extension))
+        self.touch(key)
+
+    def touch(self, key):
+        """records the use of an entry for the eviction"""
+
+        stamp = self.path(key, 'used')
+        with open(stamp, 'a'):
+            pass
+        os.utime(stamp, None)
+
+    def evict(self):
+        """removes the least recently used entries until the cache is not larger than maxsize;
+        the files of an entry are removed together"""
+
+        entries = {}
+        for name in os.listdir(self.cachedir):
+            stat = os.stat(os.path.join(self.cachedir, name))
+            (key, _, extension) = name.partition('.')
+            # [last use, size, files]; entries without stamp are removed first
+            entry = entries.setdefault(key, [0, 0, []])
+            if extension == 'used':
+                entry[0] = stat.st_mtime
+            else:
+                entry[1] += stat.st_size
+            entry[2].append(name)
+        size = sum(entry[1] for entry in entries.values())
+        for (used, entrysize, names) in sorted(entries.values()):
+            if size <= self.maxsize:
+                break
+            for name in names:
+                os.remove(os.path.join(self.cachedir, name))
+            size -= entrysize
+
+
+def openRenderCache(reviewfile, sett):
+    """opens the render cache in the directory of the review files, if configured
+
+    :param reviewfile: the path of the review files without extension
+    :param sett: the tpm settings
+    :returns: RenderCache or None
+    """
+
+    if not sett.rendercachesize:
+        return None
+    try:
+        return RenderCache(os.path.join(os.path.dirname(reviewfile), '.rendercache'),
+                           sett.rendercachesize * 1024 * 1024, templateVersion(sett.htmltemplate))
+    except (OSError, IOError) as exc:
+        print("render cache disabled; {0}".format(exc))
+        return None
+
+
+def linkFile(source, target):
+    """hard-links source to target, replacing target; copies if linking is not possible
+
+    :param source: the existing file
+    :param target: the new path
+    """
+
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except (OSError, AttributeError):
+        shutil.copyfile(source, target)
+
+
+def writeReviewOutputs(reviewtext, reviewfile, sett):
+    """writes the review as markdown, html and pdf file, as configured
+
+    if the render cache has html and pdf for the same text, they are linked
+    instead of rendered; otherwise the pdf is rendered by weasyprint in a
+    worker process while the markdown and html files are written
+
+    :param reviewtext: the review as markdown text
+    :param reviewfile: the path of the output files without extension
+    :param sett: the tpm settings
+    :returns: dict with the seconds needed per output
+    """
+
+    timings = {}
+    rendered = [extension for (extension, wanted) in (('html', sett.reviewoutputhtml),
+                ('pdf', sett.reviewoutputpdf)) if wanted]
+    cache = None
+    if rendered:
+        cache = openRenderCache(reviewfile, sett)
+    if cache is not None:
+        key = cache.key(reviewtext)
+        if all(os.path.isfile(cache.path(key, extension)) for extension in rendered):
+            start = time.time()
+            for extension in rendered:
+                cache.fetch(key, extension, '{0}.{1}'.format(reviewfile, extension))
+            timings['cache'] = time.time() - start
+            rendered = []
+
+    # an output of an earlier run may be a link to a cache entry; never write through it
+    for extension in rendered:
+        if os.path.lexists('{0}.{1}'.format(reviewfile, extension)):
+            os.remove('{0}.{1}'.format(reviewfile, extension))
+    if rendered:
+        (html, timings['markdown2html']) = timedCall(markdown2html, reviewtext, sett.htmltemplate, sett.cachedir)
+    executor = None
+    try:
+        if 'pdf' in rendered:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+            pdf = executor.submit(timedCall, html2pdf, html, '{0}.pdf'.format(reviewfile))
+        if sett.reviewoutputmd:
+            timings['md'] = timedCall(myFile, reviewtext, '{0}.md'.format(reviewfile), 'wb')[1]
+        if 'html' in rendered:
+            timings['html'] = timedCall(myFile, html, '{0}.html'.format(reviewfile), 'wb')[1]
+        if executor is not None:
+            timings['pdf'] = pdf.result()[1]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if cache is not None and rendered:
+        try:
+            for extension in rendered:
+                cache.store(key, extension, '{0}.{1}'.format(reviewfile, extension))
+            cache.evict()
+        except (OSError, IOError) as exc:
+            print("render cache not updated; {0}".format(exc))
+    return timings
+
+
+def printReviewTimings(timings, wall):
+    """prints the time needed per review stage and the time saved by running them concurrently
+
+    :param timings: dict with the seconds needed per stage
+    :param wall: the elapsed seconds for all stages
+    """
+
+    serial = sum(timings.values())
+    print('review: {0}'.format(', '.join('{0} {1:.2f}s'.format(name, timings[name]) for name in sorted(timings))))
+    print('review: {0:.2f}s elapsed, {1:.2f}s serial, {2:.2f}s saved'.format(wall, serial, serial - wall))
+
+
+def runFile(inputfile, sett, modus, backup=False, outputpath=None):
+    """runs the daily or review mode for one taskpaper file
+
+    :param inputfile: the path to the taskpaper file
+    :param sett: the tpm settings
+    :param modus: daily or review
+    :param backup: backup the taskpaper file before modifying it?
+    :param outputpath: the directory for the review files; defaults to reviewpath
+    :returns: in daily mode the list of NotificationResult for mail and pushover
+    """
+
     mycon = initDB()
-    sett = settings(configfile)
-    parseInput(inputfile, mycon, configfile)
+    cache = openParseCache(inputfile, sett)
+    parseInput(inputfile, mycon, sett, cache, sett.parseworkers)
+    if cache is not None:
+        cache.close()
     maybefile = '{0}/{1}_maybe.txt'.format(os.path.dirname(os.path.abspath(inputfile)),
                 os.path.splitext(os.path.basename(inputfile))[0])
 
     if modus == "daily":
-        removeTags(mycon)
-        setTags(mycon)
-        archiveDone(mycon)
-        archiveMaybe(mycon)
-        setNoteTag(mycon)
-        setRepeat(mycon)
+        dailyTransform(mycon)
+        encryptor = None
+        if sett.sendmail:
+            mytxtasc = createMail(mycon, sett)
+            if sett.encryptmail:
+                # encrypted once for all receivers, while the files are written
+                encryptor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+                encryption = encryptor.submit(encryptContent, mytxtasc, sett)
         if sett.debug:
             mytxt = printDebug(mycon)
             mytxt = mytxt.encode("utf-8")
@@ -1013,70 +2576,281 @@ def main():
                 shutil.move(inputfile, '{0}/backup/{1}_{2}.txt'.format(os.path.dirname(os.path.abspath(inputfile)),
                     os.path.splitext(os.path.basename(inputfile))[0], TODAY))
             myFile(mytxt, inputfile, 'w')
-            myFile(mytxtdone, '{0}/{1}_archive.txt'.format(os.path.dirname(os.path.abspath(inputfile)),
-                os.path.splitext(os.path.basename(inputfile))[0]), 'a')
+            if sett.archivesegments:
+                try:
+                    appendArchive(mytxtdone, archiveDir(inputfile), sett.archivecompress)
+                except (IOError, OSError, ValueError) as exc:
+                    sys.exit("archive operation failed; {0}".format(exc))
+            else:
+                myFile(mytxtdone, '{0}.txt'.format(archiveDir(inputfile)), 'a')
             myFile(mytxtmaybe, maybefile, 'a')
+        notifications = []
         if sett.sendmail:
             source = sett.sourceemail
-            dest = sett.destemail
-            mytxtasc = createMail(mycon, configfile)
-            myhtml = markdown2html(mytxtasc)
-            # ! todo: use encryption setting from config file
-            sendMail(myhtml, 'Taskpaper daily overview', source,
-                         dest, 'html', False, configfile)
+            if not sett.encryptmail:
+                myhtml = markdown2html(mytxtasc, sett.htmltemplate, sett.cachedir)
+            # one message per receiver; all are sent over the same smtp connection
+            for dest in sett.destemails:
+                if sett.encryptmail:
+                    notifications.append(('mail {0}'.format(dest), sendEncryptedMail, (encryption,
+                                          'Taskpaper daily overview', source, dest, sett),
+                                          sett.mailtimeout, sett.mailretries))
+                else:
+                    notifications.append(('mail {0}'.format(dest), sendMail, (myhtml, 'Taskpaper daily overview',
+                                          source, dest, 'html', False, sett), sett.mailtimeout, sett.mailretries))
         if sett.pushover:
             pushovertxt = createTaskListHigh(mycon)
             pushovertxt = '{0}\n{1}'.format(pushovertxt, createTaskListOverdue(mycon))
             # pushover limits messages sizes to 1024 characters
             if len(pushovertxt) > 1024:
                 pushovertxt = pushovertxt[:1024]
-            sendPushover(pushovertxt, configfile)
+            notifications.append(('pushover', sendPushover, (pushovertxt, sett),
+                                  sett.pushovertimeout, sett.pushoverretries))
+        results = sendNotifications(notifications)
+        if encryptor is not None:
+            encryptor.shutdown()
+        for result in results:
+            if not result.ok:
+                print('sending {0} failed after {1} attempts; {2}'.format(result.channel, result.attempts, result.error))
+            elif sett.debug:
+                print('{0} sent in {1:.2f}s, {2} attempts'.format(result.channel, result.seconds, result.attempts))
+        return results
 
     elif modus == "review":
-        reviewfile = '{0}/Review_{1}'.format(sett.reviewpath, TODAY)
-        reviewtext = '# Review\n\n'
-        reviewtext = '{0}\n{1}'.format(reviewtext, createTaskListHigh(mycon))
-        reviewtext = '{0}\n{1}'.format(reviewtext, createTaskListOverdue(mycon))
-        if sett.reviewagenda:
-            agendalist = createUniqueList(mycon, 'agenda')
-            if len(agendalist) > 0:
-                agendatasks = createTaskList(mycon, 'agenda', 'Agenda', agendalist)
-                reviewtext = '{0}\n{1}'.format(reviewtext, agendatasks)
-        if sett.reviewwaiting:
-            waitinglist = createUniqueList(mycon, 'waiting')
-            if len(waitinglist) > 0:
-                waitingtasks = createTaskList(mycon, 'waiting',
-                                          'Waiting For', waitinglist)
-                reviewtext = '{0}\n{1}'.format(reviewtext, waitingtasks)
-        if sett.reviewcustomers:
-            customerlist = createUniqueList(mycon, 'customer')
-            if len(customerlist) > 0:
-                customertasks = createTaskList(mycon, 'customer',
-                                           'Customers', customerlist)
-                reviewtext = '{0}\n{1}'.format(reviewtext, customertasks)
-        if sett.reviewprojects:
-            projectlist = createProjectList(mycon)
-            #if len(projectlist) > 0:
-                # ToDo: das muss über die neue Funktion gemacht werden
-                #projecttasks = createTaskList(mycon, 'project', 'Projects', projectlist)
-                #reviewtext = '{0}\n{1}'.format(reviewtext, projecttasks)
-        if sett.reviewmaybe:
-            maybetxt = ''
-            maybetxt = createTaskListMaybe(maybefile)
-            reviewtext = '{0}\n{1}'.format(reviewtext, maybetxt)
-
-        html = markdown2html(reviewtext)
-
-        if sett.reviewoutputmd:
-            myFile(reviewtext, '{0}.md'.format(reviewfile), 'wb')
-        if sett.reviewoutputhtml:
-            myFile(html, '{0}.html'.format(reviewfile), 'wb')
-        if sett.reviewoutputpdf:
-            html2pdf(html, '{0}.pdf'.format(reviewfile))
+        started = time.time()
+        timings = {}
+        reviewfile = '{0}/Review_{1}'.format(outputpath or sett.reviewpath, TODAY)
+        # the maybe file is read while the review lists are queried
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as reader:
+            if sett.reviewmaybe:
+                maybe = reader.submit(timedCall, createTaskListMaybe, maybefile, sett.cachedir)
+            (reviewtext, timings['lists']) = timedCall(createReviewText, mycon, sett)
+            if sett.reviewmaybe:
+                (maybetxt, timings['maybe']) = maybe.result()
+                reviewtext = '{0}\n{1}'.format(reviewtext, maybetxt)
+
+        timings.update(writeReviewOutputs(reviewtext, reviewfile, sett))
+        if sett.debug:
+            printReviewTimings(timings, time.time() - started)
     else:
         print("modus error")
         sys.exit()
 
 
+def batchUsage():
+    """Prints usage information for the batch mode."""
+
+    print('tpm.py --batch -c <configfile> -m <mode:daily|review> [-j <workers>] <file|glob>[=<outputpath>] ...')
+    print('optional: -b to backup the todo-files before modifying them')
+
+
+def parseBatchArgs(argv):
+    """parse and verify the commandline args of the batch mode
+
+    :param argv: list of commandline arguments, minus the first and --batch
+    :returns: list of file specifications, path to the config file, the mode (daily|review),
+        backup flag and the number of worker processes (None for one per cpu)
+    """
+
+    configfile = ''
+    modus = ''
+    backup = False
+    workers = None
+
+    try:
+        opts, args = getopt.getopt(argv, "hbc:m:j:", ["help", "conffile=", "modus=", "jobs="])
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                batchUsage()
+                sys.exit()
+            elif opt in ("-b", "--backup"):
+                backup = True
+            elif opt in ("-c", "--conffile"):
+                configfile = arg
+            elif opt in ("-m", "--modus"):
+                modus = arg
+            elif opt in ("-j", "--jobs"):
+                workers = int(arg)
+    except (getopt.GetoptError, ValueError):
+        batchUsage()
+        sys.exit(2)
+    if configfile == '' or modus not in ('daily', 'review') or not args:
+        batchUsage()
+        sys.exit(2)
+    return (args, configfile, modus, backup, workers)
+
+
+def expandBatchFiles(filespecs):
+    """expands the file specifications of the batch mode
+
+    :param filespecs: list of file names or glob patterns, each optionally followed by =outputpath
+    :returns: list of tuples (inputfile, outputpath); outputpath is None if not given;
+        if a pattern matches several files, each file gets a subdirectory of outputpath
+    """
+
+    jobs = []
+    seen = set()
+    for filespec in filespecs:
+        (pattern, _, outputpath) = filespec.partition('=')
+        # keep names without match, so the missing file shows up in the report
+        inputfiles = sorted(glob.glob(pattern)) or [pattern]
+        for inputfile in inputfiles:
+            if inputfile in seen:
+                continue
+            seen.add(inputfile)
+            if outputpath and len(inputfiles) > 1:
+                jobs.append((inputfile, os.path.join(outputpath, os.path.splitext(os.path.basename(inputfile))[0])))
+            else:
+                jobs.append((inputfile, outputpath or None))
+    return jobs
+
+
+def runBatchJob(job):
+    """runs one file of the batch mode; executed in a worker process
+
+    :param job: tuple (inputfile, outputpath, configfile, modus, backup)
+    :returns: tuple (inputfile, exit status, error message, runtime in seconds)
+    """
+
+    (inputfile, outputpath, configfile, modus, backup) = job
+    status = 0
+    message = ''
+    start = time.time()
+    try:
+        sett = loadSettings(configfile)
+        if outputpath is None:
+            # the review files of all batch files would collide in reviewpath
+            outputpath = os.path.join(sett.reviewpath, os.path.splitext(os.path.basename(inputfile))[0])
+        if modus == 'review' and not os.path.isdir(outputpath):
+            os.makedirs(outputpath)
+        message = failedNotifications(runFile(inputfile, sett, modus, backup, outputpath))
+        if message:
+            status = 1
+    except SystemExit as exc:
+        if isinstance(exc.code, int):
+            status = exc.code
+        elif exc.code is not None:
+            status = 1
+            message = '{0}'.format(exc.code)
+    except Exception as exc:
+        status = 1
+        message = '{0}: {1}'.format(type(exc).__name__, exc)
+    finally:
+        # the worker process ends without closing open connections
+        closeMailTransports()
+    return (inputfile, status, message, time.time() - start)
+
+
+def runBatch(jobs, configfile, modus, backup=False, workers=None):
+    """processes several taskpaper files in parallel worker processes
+
+    every file gets its own database; a failing file does not stop the others
+
+    :param jobs: list of tuples (inputfile, outputpath), see expandBatchFiles
+    :param configfile: the tpm config file
+    :param modus: daily or review
+    :param backup: backup the taskpaper files before modifying them?
+    :param workers: the number of worker processes; None for one per cpu
+    :returns: list of results of runBatchJob, in the order of jobs
+    """
+
+    batchjobs = [(inputfile, outputpath, configfile, modus, backup) for (inputfile, outputpath) in jobs]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(runBatchJob, batchjobs))
+
+
+def printBatchReport(results):
+    """prints the results of runBatch
+
+    :param results: list of results of runBatchJob
+    :returns: aggregated exit status; 0 if all files were processed successfully
+    """
+
+    failed = 0
+    for (inputfile, status, message, seconds) in results:
+        if status == 0:
+            print('ok     {0:7.2f}s {1}'.format(seconds, inputfile))
+        else:
+            failed += 1
+            print('FAILED {0:7.2f}s {1}: {2}'.format(seconds, inputfile, message or 'exit status {0}'.format(status)))
+    print('{0} files processed, {1} failed'.format(len(results), failed))
+    return 1 if failed else 0
+
+
+def batchMain(argv):
+    (filespecs, configfile, modus, backup, workers) = parseBatchArgs(argv)
+    jobs = expandBatchFiles(filespecs)
+    return printBatchReport(runBatch(jobs, configfile, modus, backup, workers))
+
+
+def archiveUsage():
+    """Prints usage information for the archive search."""
+
+    print('tpm.py --archive [-s <yyyy-mm-dd>] [-e <yyyy-mm-dd>] [-p <project>] [-t <tag>[(<value>)]] <inputfile>')
+    print('searches the done tasks in the segmented archive of inputfile; -s and -e limit the @done date')
+
+
+def parseArchiveArgs(argv):
+    """parse and verify the commandline args of the archive search
+
+    :param argv: list of commandline arguments, minus the first and --archive
+    :returns: tuple (inputfile, first done date, last done date, project, (tag name, value))
+    """
+
+    since = None
+    until = None
+    project = None
+    tag = None
+
+    try:
+        opts, args = getopt.getopt(argv, "hs:e:p:t:", ["help", "since=", "until=", "project=", "tag="])
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                archiveUsage()
+                sys.exit()
+            elif opt in ("-s", "--since"):
+                since = parseDate(arg)
+            elif opt in ("-e", "--until"):
+                until = parseDate(arg)
+            elif opt in ("-p", "--project"):
+                project = arg
+            elif opt in ("-t", "--tag"):
+                match = TAGPATTERN.match('@{0}'.format(arg.lstrip('@')))
+                if match is None:
+                    raise ValueError(arg)
+                tag = (match.group(1), match.group(2))
+    except (getopt.GetoptError, ValueError, OverflowError):
+        archiveUsage()
+        sys.exit(2)
+    if len(args) != 1:
+        archiveUsage()
+        sys.exit(2)
+    return (args[0], since, until, project, tag)
+
+
+def archiveMain(argv):
+    (inputfile, since, until, project, tag) = parseArchiveArgs(argv)
+    for task in searchArchive(archiveDir(inputfile), since, until, project, tag):
+        print(task, end='')
+    return 0
+
+
+def main():
+    if sys.argv[1:2] == ['--batch']:
+        return batchMain(sys.argv[2:])
+    if sys.argv[1:2] == ['--archive']:
+        return archiveMain(sys.argv[2:])
+    (inputfile, configfile, modus, backup) = parseArgs(sys.argv[1:])
+    sett = loadSettings(configfile)
+    try:
+        results = runFile(inputfile, sett, modus, backup)
+    finally:
+        closeMailTransports()
+    # cron and monitoring see failed deliveries in the exit status
+    if failedNotifications(results):
+        return 1
+    return 0
+
+
 if __name__ == '__main__':
     sys.exit(main())